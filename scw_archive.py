@@ -0,0 +1,393 @@
+"""
+取得した雲量予報のスナップショットをお気に入りごとに蓄積し、実測と比べてモデルの当たり具合を採点する。
+保存形式: <archive>/model=<モデル>/run=<初期時刻>/part-*.npz（列指向・追記は小さなファイルを置くだけ）
+地点は表示名ではなく緯度経度（小数 5 桁）で区別する。同じ予報を取り直して追記した場合は最新の行だけを使う。
+モデル名はページのボタンと対応させるため msm78 / ecmwf / gfs / icon / jma_msm を使う。
+使い方:
+  python scw_archive.py append archive/ snapshot.json        # スナップショットを追記
+  python scw_archive.py compact archive/                      # 小さな part をまとめる
+  python scw_archive.py score archive/ observed.csv [--csv skill.csv]
+  python scw_server.py --archive archive/ --observed observed.csv  # 取得側からの追記と、ページでの推奨モデル表示
+必要ライブラリ: numpy
+"""
+
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+
+
+# ページのボタンと対応するモデル名。ディレクトリ名に使うのでこれ以外は受け付けない
+MODELS = ("msm78", "ecmwf", "gfs", "icon", "jma_msm")
+COLUMNS = ("site", "lat", "lng", "run_time", "valid_time", "cloud")
+COMPACT_FILE = "data.npz"
+# リードタイムの区切り（時間）。最後の区間は上限なし
+LEAD_BUCKETS_H = (0, 6, 12, 24, 48, 72)
+# この雲量(%)未満を「晴れ」とみなして的中率を出す
+CLEAR_THRESHOLD = 30.0
+# 採点時の予報と実測の突き合わせ単位（秒）
+OBS_RESOLUTION_S = 3600
+
+
+def parse_time(value):
+  """ISO 8601 文字列または epoch 秒を UTC の epoch 秒(int)にする。タイムゾーンなしは UTC とみなす。"""
+  if isinstance(value, (int, float)):
+    return int(value)
+  # CSV の列は文字列で来るので、数字だけなら epoch 秒とみなす
+  if str(value).strip().lstrip("-").isdigit():
+    return int(value)
+  dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+  if dt.tzinfo is None:
+    dt = dt.replace(tzinfo=timezone.utc)
+  return int(dt.timestamp())
+
+
+def _run_label(run_time):
+  return datetime.fromtimestamp(run_time, timezone.utc).strftime("%Y%m%dT%H%M")
+
+
+def _read_npz(path):
+  with np.load(path, allow_pickle=False) as z:
+    return {c: z[c] for c in COLUMNS}
+
+
+def _concat(tables):
+  return {c: np.concatenate([t[c] for t in tables]) for c in COLUMNS}
+
+
+def site_key(lat, lng):
+  """地点のキー。scw_route のお気に入りキーと同じく小数 5 桁に丸めた緯度経度。"""
+  return (round(float(lat), 5), round(float(lng), 5))
+
+
+def _site_ids(lat, lng):
+  """緯度経度を丸めた地点キーごとの整数 id と、id 順の地点キー (緯度, 経度) の配列を返す。"""
+  coords = np.stack([np.round(np.asarray(lat) * 1e5), np.round(np.asarray(lng) * 1e5)], axis=1).astype(np.int64)
+  keys, inv = np.unique(coords, axis=0, return_inverse=True)
+  return inv.ravel(), keys / 1e5
+
+
+def _dedupe(table):
+  """同じ (地点, 初期時刻, 対象時刻) の行は最後に追記したものだけ残す。table は追記順に並んでいること。"""
+  n = len(table["cloud"])
+  if n == 0:
+    return table
+  site, _ = _site_ids(table["lat"], table["lng"])
+  key = np.stack([site, table["run_time"], table["valid_time"]], axis=1)
+  # 逆順にして最初の出現を取ると、元の順での最後（最新）の行になる
+  _, first = np.unique(key[::-1], axis=0, return_index=True)
+  if len(first) == n:
+    return table
+  keep = np.sort(n - 1 - first)
+  return {c: table[c][keep] for c in COLUMNS}
+
+
+def _write_npz(path, table):
+  """一時ファイルに書いてから rename し、読み手が書きかけのファイルを見ないようにする。"""
+  tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+  with open(tmp, "wb") as f:
+    np.savez(f, **table)
+  os.replace(tmp, path)
+
+
+class ForecastArchive:
+  """モデル・初期時刻でパーティション分けした列指向の予報アーカイブ。"""
+
+  def __init__(self, root):
+    self.root = Path(root)
+    self.root.mkdir(parents=True, exist_ok=True)
+    self._compact_lock = threading.Lock()
+    self._compactor = None
+    self._stop = threading.Event()
+
+  def partition_dir(self, model, run_time):
+    if model not in MODELS:
+      raise ValueError(f"未知のモデルです: {model!r}（{' / '.join(MODELS)}）")
+    return self.root / f"model={model}" / f"run={_run_label(run_time)}"
+
+  def append(self, model, run_time, site, lat, lng, valid_times, cloud):
+    """1 地点分の予報スナップショットを追記する。既存ファイルには触れないので安価。"""
+    run_time = parse_time(run_time)
+    part_dir = self.partition_dir(model, run_time)
+    valid = np.asarray([parse_time(t) for t in valid_times], dtype=np.int64)
+    values = np.asarray(cloud, dtype=np.float32)
+    if valid.shape != values.shape:
+      raise ValueError("valid_times と cloud の長さが一致しません")
+    n = len(valid)
+    table = {
+      "site": np.full(n, site, dtype=f"U{max(1, len(site))}"),
+      "lat": np.full(n, lat, dtype=np.float64),
+      "lng": np.full(n, lng, dtype=np.float64),
+      "run_time": np.full(n, run_time, dtype=np.int64),
+      "valid_time": valid,
+      "cloud": values,
+    }
+    part_dir.mkdir(parents=True, exist_ok=True)
+    path = part_dir / f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.npz"
+    _write_npz(path, table)
+    return path
+
+  def append_snapshot(self, snapshot):
+    """JSON 形式のスナップショットを追記する。
+
+    {"model": "msm78", "run_time": "2026-10-19T00:00Z", "site": "名前", "lat": 36.1, "lng": 138.2,
+     "forecast": [{"time": "2026-10-19T12:00Z", "cloud": 40}, ...]}
+    """
+    rows = snapshot["forecast"]
+    return self.append(
+      snapshot["model"],
+      snapshot["run_time"],
+      snapshot["site"],
+      float(snapshot["lat"]),
+      float(snapshot["lng"]),
+      [r["time"] for r in rows],
+      [float(r["cloud"]) for r in rows],
+    )
+
+  def partitions(self):
+    for model_dir in sorted(self.root.glob("model=*")):
+      for run_dir in sorted(model_dir.glob("run=*")):
+        yield model_dir.name.split("=", 1)[1], run_dir
+
+  def compact_partition(self, run_dir):
+    """パーティション内の part を data.npz にまとめる（重複行は最新を残す）。まとめた part 数を返す。"""
+    # part のファイル名は追記時刻順なので、data.npz の後ろに並べれば全体が追記順になる
+    parts = sorted(run_dir.glob("part-*.npz"))
+    if not parts:
+      return 0
+    tables = [_read_npz(p) for p in parts]
+    target = run_dir / COMPACT_FILE
+    if target.exists():
+      tables.insert(0, _read_npz(target))
+    _write_npz(target, _dedupe(_concat(tables)))
+    for p in parts:
+      p.unlink()
+    return len(parts)
+
+  def compact(self):
+    with self._compact_lock:
+      return sum(self.compact_partition(run_dir) for _, run_dir in self.partitions())
+
+  def start_compactor(self, interval=600):
+    """バックグラウンドスレッドで定期的にコンパクションする。"""
+    if self._compactor is not None:
+      return
+    self._stop.clear()
+
+    def loop():
+      while not self._stop.wait(interval):
+        try:
+          self.compact()
+        except Exception as e:
+          print(f"コンパクションに失敗しました: {e}", file=sys.stderr)
+
+    self._compactor = threading.Thread(target=loop, name="archive-compactor", daemon=True)
+    self._compactor.start()
+
+  def stop_compactor(self):
+    if self._compactor is None:
+      return
+    self._stop.set()
+    self._compactor.join()
+    self._compactor = None
+
+  def load(self, models=None):
+    """全パーティションを読み込み、model 列を加えた列の辞書を返す。"""
+    tables = []
+    model_col = []
+    with self._compact_lock:
+      for model, run_dir in self.partitions():
+        if models and model not in models:
+          continue
+        # data.npz → part-<時刻>... の順に読むと追記順になるので、未コンパクトの重複もここで除ける
+        files = sorted(run_dir.glob("*.npz"))
+        if not files:
+          continue
+        t = _dedupe(_concat([_read_npz(f) for f in files]))
+        tables.append(t)
+        model_col.append(np.full(len(t["cloud"]), model))
+    if not tables:
+      empty = {c: np.empty(0) for c in COLUMNS}
+      empty["model"] = np.empty(0, dtype="U1")
+      return empty
+    table = _concat(tables)
+    table["model"] = np.concatenate(model_col)
+    return table
+
+
+def load_observations(path):
+  """実測雲量 CSV（lat,lng,time,cloud。site 列は任意で表示用）を読み込む。"""
+  lats = []
+  lngs = []
+  times = []
+  clouds = []
+  with open(path, newline="", encoding="utf-8") as f:
+    for row in csv.DictReader(f):
+      lats.append(float(row["lat"]))
+      lngs.append(float(row["lng"]))
+      times.append(parse_time(row["time"]))
+      clouds.append(float(row["cloud"]))
+  return {
+    "lat": np.asarray(lats, dtype=np.float64),
+    "lng": np.asarray(lngs, dtype=np.float64),
+    "time": np.asarray(times, dtype=np.int64),
+    "cloud": np.asarray(clouds, dtype=np.float32),
+  }
+
+
+def _lead_bucket_labels():
+  edges = LEAD_BUCKETS_H
+  labels = [f"{a}-{b}h" for a, b in zip(edges, edges[1:])]
+  labels.append(f"{edges[-1]}h+")
+  return labels
+
+
+def score(forecasts, observations):
+  """予報と実測をベクトル演算で突き合わせ、モデル×地点×リードタイム区間の成績表を返す。
+
+  返り値は dict のリスト（model, site, lat, lng, lead, n, mae, rmse, bias, clear_hit_rate）。
+  site は地点の最新の表示名で、集計自体は丸めた緯度経度で行う。
+  """
+  if len(forecasts["cloud"]) == 0 or len(observations["cloud"]) == 0:
+    return []
+  # 地点キーを共通の整数 id にし、(地点, 時刻ビン) を 1 本の int64 キーにする
+  n_fc = len(forecasts["cloud"])
+  inv, all_sites = _site_ids(
+    np.concatenate([forecasts["lat"], observations["lat"]]),
+    np.concatenate([forecasts["lng"], observations["lng"]]),
+  )
+  f_site = inv[:n_fc]
+  o_site = inv[n_fc:]
+  # 表示名は各地点で最も新しい初期時刻の予報に付いていたもの
+  latest = np.lexsort((forecasts["run_time"], f_site))
+  tail = np.ones(len(latest), dtype=bool)
+  tail[:-1] = f_site[latest][1:] != f_site[latest][:-1]
+  names = dict(zip(f_site[latest][tail].tolist(), forecasts["site"][latest][tail].tolist()))
+  f_bin = np.round(forecasts["valid_time"] / OBS_RESOLUTION_S).astype(np.int64)
+  o_bin = np.round(observations["time"] / OBS_RESOLUTION_S).astype(np.int64)
+  stride = max(int(f_bin.max()), int(o_bin.max())) + 1
+  f_key = f_site.astype(np.int64) * stride + f_bin
+  o_key = o_site.astype(np.int64) * stride + o_bin
+
+  order = np.argsort(o_key, kind="stable")
+  o_key = o_key[order]
+  o_cloud = observations["cloud"][order]
+  pos = np.searchsorted(o_key, f_key)
+  pos_clipped = np.minimum(pos, len(o_key) - 1)
+  matched = o_key[pos_clipped] == f_key
+  if not matched.any():
+    return []
+
+  obs = o_cloud[pos_clipped[matched]].astype(np.float64)
+  fc = forecasts["cloud"][matched].astype(np.float64)
+  lead_h = (forecasts["valid_time"][matched] - forecasts["run_time"][matched]) / 3600
+  lead_idx = np.searchsorted(np.asarray(LEAD_BUCKETS_H), lead_h, side="right") - 1
+  keep = lead_idx >= 0
+  obs, fc, lead_idx = obs[keep], fc[keep], lead_idx[keep]
+  models, m_idx = np.unique(forecasts["model"][matched][keep], return_inverse=True)
+  s_idx = f_site[matched][keep]
+
+  n_lead = len(LEAD_BUCKETS_H)
+  group = (m_idx * len(all_sites) + s_idx) * n_lead + lead_idx
+  groups, g_inv = np.unique(group, return_inverse=True)
+  err = fc - obs
+  n = np.bincount(g_inv)
+  mae = np.bincount(g_inv, weights=np.abs(err)) / n
+  rmse = np.sqrt(np.bincount(g_inv, weights=err * err) / n)
+  bias = np.bincount(g_inv, weights=err) / n
+  hit = (fc < CLEAR_THRESHOLD) == (obs < CLEAR_THRESHOLD)
+  hit_rate = np.bincount(g_inv, weights=hit.astype(np.float64)) / n
+
+  labels = _lead_bucket_labels()
+  table = []
+  for i, g in enumerate(groups):
+    g = int(g)
+    lead = g % n_lead
+    site = (g // n_lead) % len(all_sites)
+    model = g // n_lead // len(all_sites)
+    lat, lng = site_key(*all_sites[site])
+    table.append({
+      "model": str(models[model]),
+      "site": names.get(site, f"{lat:.5f},{lng:.5f}"),
+      "lat": lat,
+      "lng": lng,
+      "lead": labels[lead],
+      "n": int(n[i]),
+      "mae": round(float(mae[i]), 2),
+      "rmse": round(float(rmse[i]), 2),
+      "bias": round(float(bias[i]), 2),
+      "clear_hit_rate": round(float(hit_rate[i]), 3),
+    })
+  return table
+
+
+def best_model(table, site=None, max_lead_h=48):
+  """max_lead_h 以内の区間で件数加重 MAE が最小のモデルを返す（該当なしは None）。
+
+  site に site_key() の (緯度, 経度) を渡すとその地点だけで比べる。
+  """
+  allowed = {label for label, start in zip(_lead_bucket_labels(), LEAD_BUCKETS_H) if start < max_lead_h}
+  totals = {}
+  for row in table:
+    if row["lead"] not in allowed or (site is not None and (row["lat"], row["lng"]) != site):
+      continue
+    err, n = totals.get(row["model"], (0.0, 0))
+    totals[row["model"]] = (err + row["mae"] * row["n"], n + row["n"])
+  if not totals:
+    return None
+  return min(totals, key=lambda m: totals[m][0] / totals[m][1])
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="予報スナップショットのアーカイブと採点")
+  sub = parser.add_subparsers(dest="cmd", required=True)
+  a = sub.add_parser("append", help="スナップショット JSON（1 件またはリスト）を追記")
+  a.add_argument("archive")
+  a.add_argument("snapshots", nargs="+")
+  c = sub.add_parser("compact", help="part ファイルをパーティションごとにまとめる")
+  c.add_argument("archive")
+  s = sub.add_parser("score", help="実測 CSV（lat,lng,time,cloud）と比べて成績表を出す")
+  s.add_argument("archive")
+  s.add_argument("observed")
+  s.add_argument("--csv", help="成績表を CSV で保存する")
+  s.add_argument("--max-lead", type=float, default=48, help="既定モデル選択に使うリードタイム上限（時間）")
+  args = parser.parse_args(argv)
+
+  archive = ForecastArchive(args.archive)
+  if args.cmd == "append":
+    count = 0
+    for path in args.snapshots:
+      data = json.loads(Path(path).read_text(encoding="utf-8"))
+      for snap in data if isinstance(data, list) else [data]:
+        archive.append_snapshot(snap)
+        count += 1
+    print(f"{count} 件のスナップショットを追記しました")
+  elif args.cmd == "compact":
+    print(f"{archive.compact()} 個の part をまとめました")
+  else:
+    table = score(archive.load(), load_observations(args.observed))
+    if not table:
+      print("突き合わせできる予報と実測がありません")
+      return
+    fields = list(table[0].keys())
+    out = open(args.csv, "w", newline="", encoding="utf-8") if args.csv else sys.stdout
+    try:
+      writer = csv.DictWriter(out, fieldnames=fields)
+      writer.writeheader()
+      writer.writerows(table)
+    finally:
+      if args.csv:
+        out.close()
+    print(f"既定モデルの推奨: {best_model(table, max_lead_h=args.max_lead)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,353 @@
+"""
+ローカルの数値予報格子（GRIB2 / NetCDF）からシーイングと透明度の指数を計算し、点問い合わせと地図タイルで提供する。
+使い方:
+  python scw_indices.py compute msm_pressure.grib2 indices/ [--workers 8]
+  python scw_indices.py point indices/ 36.1 138.2
+計算結果は <出力先>/run-<時刻>/ に seeing.npy, transparency.npy（メモリマップ）と lat/lon.npy を書き、
+最後に <出力先>/meta.json を置き換えて切り替える。配信中のサーバーが開いている配列は書き換えない。
+必要ライブラリ: numpy（読み込みに xarray、GRIB2 の場合は cfgrib も）
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import math
+import os
+import shutil
+import struct
+import time
+import zlib
+
+import numpy as np
+
+
+# 変数名の候補（cfgrib / NetCDF でよく使われる名前）
+VAR_ALIASES = {
+  "u": ("u", "ugrd", "UGRD", "u_component_of_wind", "eastward_wind"),
+  "v": ("v", "vgrd", "VGRD", "v_component_of_wind", "northward_wind"),
+  "t": ("t", "tmp", "TMP", "temperature", "air_temperature"),
+  "rh": ("r", "rh", "RH", "relative_humidity"),
+  "aod": ("aod550", "aod", "AOTK", "total_aerosol_optical_depth_at_550nm"),
+}
+LEVEL_DIMS = ("isobaricInhPa", "level", "pressure", "lev", "plev")
+LAT_NAMES = ("latitude", "lat")
+LON_NAMES = ("longitude", "lon")
+TIME_DIMS = ("step", "time", "valid_time")
+
+# 指数に使う気圧面の範囲 (hPa)
+FREE_ATMOSPHERE_HPA = (850, 150)
+JET_LEVELS_HPA = (300, 150)
+HUMIDITY_LEVELS_HPA = (1000, 500)
+# 標準大気の気温減率 (K/m)
+STANDARD_LAPSE = -0.0065
+# 正規化の目安。これらの値で各項が 1（最悪）になる
+SHEAR_SCALE = 0.01
+JET_CALM = 20.0
+JET_SCALE = 50.0
+LAPSE_DEVIATION_SCALE = 0.005
+RH_CLEAR = 30.0
+RH_SCALE = 60.0
+AOD_SCALE = 0.5
+SEEING_WEIGHTS = (0.45, 0.35, 0.2)
+SEEING_BEST_ARCSEC = 0.6
+SEEING_RANGE_ARCSEC = 2.4
+ROW_CHUNK = 32
+TILE_SIZE = 256
+TILE_ALPHA = 150
+# 良 → 悪 の色（緑・黄・赤）
+COLOR_STOPS = ((0.0, (34, 197, 94)), (0.5, (234, 179, 8)), (1.0, (220, 38, 38)))
+INDEX_NAMES = ("seeing", "transparency")
+# 残しておく計算結果の版の数。直前の版はまだ切り替えていないサーバーが開いている可能性がある
+KEEP_RUNS = 2
+
+
+def standard_height_m(p_hpa):
+  """標準大気での気圧面の高度 (m)。格子に高度場がなくても層の厚さを出せるようにする。"""
+  return 44330.8 * (1 - (np.asarray(p_hpa, dtype=np.float64) / 1013.25) ** 0.190263)
+
+
+def _pick(ds, names, required=True):
+  for n in names:
+    if n in ds.variables:
+      return ds[n]
+  if required:
+    raise KeyError(f"変数が見つかりません: {names[0]}（候補: {', '.join(names)}）")
+  return None
+
+
+def load_fields(path):
+  """GRIB2 / NetCDF を読み、(時刻, 気圧面, 緯度, 経度) の numpy 配列にそろえて返す。"""
+  import xarray as xr
+
+  path = Path(path)
+  engine = "cfgrib" if path.suffix.lower() in (".grib2", ".grb2", ".grib", ".grb") else None
+  kwargs = {"filter_by_keys": {"typeOfLevel": "isobaricInhPa"}} if engine == "cfgrib" else {}
+  ds = xr.open_dataset(path, engine=engine, backend_kwargs=kwargs or None)
+  lat_name = next(n for n in LAT_NAMES if n in ds.coords)
+  lon_name = next(n for n in LON_NAMES if n in ds.coords)
+  level_name = next(n for n in LEVEL_DIMS if n in ds.coords)
+  time_name = next((n for n in TIME_DIMS if n in ds.dims), None)
+
+  def arr(da, with_level=True):
+    dims = ([time_name] if time_name else []) + ([level_name] if with_level else []) + [lat_name, lon_name]
+    data = da.transpose(*dims).values.astype(np.float32)
+    if not time_name:
+      data = data[np.newaxis]
+    return data
+
+  fields = {key: arr(_pick(ds, VAR_ALIASES[key])) for key in ("u", "v", "t", "rh")}
+  aod = _pick(ds, VAR_ALIASES["aod"], required=False)
+  fields["aod"] = arr(aod, with_level=False) if aod is not None else None
+  fields["levels"] = ds[level_name].values.astype(np.float64)
+  fields["lat"] = ds[lat_name].values.astype(np.float64)
+  fields["lon"] = ds[lon_name].values.astype(np.float64)
+  if time_name:
+    times = ds["valid_time"].values if "valid_time" in ds.coords else ds[time_name].values
+    fields["times"] = [str(t) for t in np.atleast_1d(times)]
+  else:
+    fields["times"] = [str(ds["time"].values)] if "time" in ds.coords else ["0"]
+  return normalize_fields(fields)
+
+
+def normalize_fields(fields):
+  """気圧面を高圧→低圧、緯度・経度を昇順に並べ替える（タイル・点問い合わせを単純にするため）。"""
+  order = np.argsort(-fields["levels"])
+  lat_flip = fields["lat"][0] > fields["lat"][-1]
+  lon_flip = fields["lon"][0] > fields["lon"][-1]
+  out = dict(fields)
+  out["levels"] = fields["levels"][order]
+  for key in ("u", "v", "t", "rh"):
+    a = fields[key][:, order]
+    if lat_flip:
+      a = a[:, :, ::-1]
+    if lon_flip:
+      a = a[:, :, :, ::-1]
+    out[key] = np.ascontiguousarray(a)
+  if fields.get("aod") is not None:
+    a = fields["aod"]
+    if lat_flip:
+      a = a[:, ::-1]
+    if lon_flip:
+      a = a[:, :, ::-1]
+    out["aod"] = np.ascontiguousarray(a)
+  out["lat"] = fields["lat"][::-1] if lat_flip else fields["lat"]
+  out["lon"] = fields["lon"][::-1] if lon_flip else fields["lon"]
+  return out
+
+
+def _level_mask(levels, bounds):
+  hi, lo = bounds
+  return (levels <= hi) & (levels >= lo)
+
+
+def compute_block(u, v, t, rh, aod, levels):
+  """(時刻, 気圧面, 行, 列) のブロックに対してシーイング(秒角)と透明度(0〜1, 1 が最良)を計算する。
+
+  経験的な簡易指標であり、次の要素を組み合わせる。
+  シーイング: 自由大気の鉛直シア、ジェット気流の強さ、標準減率からの気温減率のずれ
+  透明度: 下層〜中層の相対湿度、エアロゾル光学的厚さ（あれば）
+  """
+  z = standard_height_m(levels)
+  dz = np.diff(z)[None, :, None, None]
+  layer_p = 0.5 * (levels[:-1] + levels[1:])
+  free = _level_mask(layer_p, FREE_ATMOSPHERE_HPA)
+  weights = (np.diff(z) * free)[None, :, None, None]
+  weight_sum = max(float(weights.sum()), 1e-9)
+
+  shear = np.hypot(np.diff(u, axis=1), np.diff(v, axis=1)) / dz
+  shear_term = np.clip((shear * weights).sum(axis=1) / weight_sum / SHEAR_SCALE, 0, 1)
+
+  lapse_dev = np.abs(np.diff(t, axis=1) / dz - STANDARD_LAPSE)
+  thermal_term = np.clip((lapse_dev * weights).sum(axis=1) / weight_sum / LAPSE_DEVIATION_SCALE, 0, 1)
+
+  jet_mask = _level_mask(levels, JET_LEVELS_HPA)
+  if jet_mask.any():
+    jet = np.hypot(u[:, jet_mask], v[:, jet_mask]).max(axis=1)
+  else:
+    jet = np.zeros(shear_term.shape, dtype=np.float32)
+  jet_term = np.clip((jet - JET_CALM) / JET_SCALE, 0, 1)
+
+  ws, wj, wt = SEEING_WEIGHTS
+  seeing = SEEING_BEST_ARCSEC + SEEING_RANGE_ARCSEC * (ws * shear_term + wj * jet_term + wt * thermal_term)
+
+  hum_mask = _level_mask(levels, HUMIDITY_LEVELS_HPA)
+  rh_mean = rh[:, hum_mask].mean(axis=1) if hum_mask.any() else rh.mean(axis=1)
+  rh_term = np.clip((rh_mean - RH_CLEAR) / RH_SCALE, 0, 1)
+  aod_term = np.clip(aod / AOD_SCALE, 0, 1) if aod is not None else 0.0
+  transparency = (1 - rh_term) * (1 - aod_term)
+  return seeing.astype(np.float32), transparency.astype(np.float32)
+
+
+def compute_indices(fields, out_dir, workers=None):
+  """全格子を行ブロックに分けて並列計算し、新しい版のディレクトリのメモリマップ配列に書き込む。
+
+  書き終えてから meta.json を置き換えるので、読み手は古い版か新しい版のどちらか一式だけを見る。
+  """
+  out_dir = Path(out_dir)
+  run_name = f"run-{time.time_ns()}"
+  run_dir = out_dir / run_name
+  run_dir.mkdir(parents=True)
+  nt, _, ny, nx = fields["u"].shape
+  outputs = {
+    name: np.lib.format.open_memmap(run_dir / f"{name}.npy", mode="w+", dtype=np.float32, shape=(nt, ny, nx))
+    for name in INDEX_NAMES
+  }
+  aod = fields.get("aod")
+  levels = fields["levels"]
+
+  def run(r0):
+    r1 = min(r0 + ROW_CHUNK, ny)
+    rows = slice(r0, r1)
+    seeing, transparency = compute_block(
+      fields["u"][:, :, rows], fields["v"][:, :, rows], fields["t"][:, :, rows], fields["rh"][:, :, rows],
+      aod[:, rows] if aod is not None else None, levels,
+    )
+    outputs["seeing"][:, rows] = seeing
+    outputs["transparency"][:, rows] = transparency
+
+  # numpy の要素演算は GIL を解放するので、スレッドで複数コアを使える
+  with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+    list(pool.map(run, range(0, ny, ROW_CHUNK)))
+  for arr in outputs.values():
+    arr.flush()
+  del outputs
+  np.save(run_dir / "lat.npy", fields["lat"])
+  np.save(run_dir / "lon.npy", fields["lon"])
+  meta = {
+    "run": run_name, "times": fields["times"], "levels": [float(x) for x in levels], "has_aod": aod is not None,
+  }
+  tmp = out_dir / f".meta.json.{run_name}.tmp"
+  tmp.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+  os.replace(tmp, out_dir / "meta.json")
+  # 古い版を消す。Linux では開いたままのメモリマップは消しても読めるが、Windows では消せないので次回に回す
+  for old in sorted(out_dir.glob("run-*"), key=lambda d: int(d.name[4:]))[:-KEEP_RUNS]:
+    shutil.rmtree(old, ignore_errors=True)
+  return run_dir
+
+
+# --- 配信（点問い合わせ・タイル） -----------------------------------------
+
+def _png(rgba):
+  """(高さ, 幅, 4) の uint8 配列を PNG バイト列にする。"""
+  h, w, _ = rgba.shape
+  raw = np.concatenate([np.zeros((h, 1), dtype=np.uint8), rgba.reshape(h, w * 4)], axis=1).tobytes()
+
+  def chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+  return (
+    b"\x89PNG\r\n\x1a\n"
+    + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+    + chunk(b"IDAT", zlib.compress(raw, 6))
+    + chunk(b"IEND", b"")
+  )
+
+
+def _badness(name, values):
+  """色付け用に 0（良）〜 1（悪）へ正規化する。"""
+  if name == "seeing":
+    return np.clip((values - SEEING_BEST_ARCSEC) / SEEING_RANGE_ARCSEC, 0, 1)
+  return np.clip(1 - values, 0, 1)
+
+
+def _colorize(bad):
+  pos = [s[0] for s in COLOR_STOPS]
+  channels = [np.interp(bad, pos, [s[1][c] for s in COLOR_STOPS]) for c in range(3)]
+  return np.stack(channels, axis=-1).astype(np.uint8)
+
+
+class IndexStore:
+  """compute_indices の出力をメモリマップで開き、点問い合わせとタイル画像を返す。"""
+
+  def __init__(self, directory):
+    self.directory = Path(directory)
+    meta_path = self.directory / "meta.json"
+    self._meta_mtime = meta_path.stat().st_mtime_ns
+    self.meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    data_dir = self.directory / self.meta.get("run", "")
+    self.lat = np.load(data_dir / "lat.npy")
+    self.lon = np.load(data_dir / "lon.npy")
+    self.arrays = {name: np.load(data_dir / f"{name}.npy", mmap_mode="r") for name in INDEX_NAMES}
+    self._dlat = (self.lat[-1] - self.lat[0]) / max(len(self.lat) - 1, 1)
+    self._dlon = (self.lon[-1] - self.lon[0]) / max(len(self.lon) - 1, 1)
+
+  @property
+  def times(self):
+    return self.meta["times"]
+
+  def stale(self):
+    """compute_indices が新しい版に切り替えていれば True。開き直すかの判断に使う。"""
+    try:
+      return (self.directory / "meta.json").stat().st_mtime_ns != self._meta_mtime
+    except OSError:
+      return False
+
+  def _indices(self, lat, lng):
+    """等間隔格子を仮定して最寄り格子点の添字を返す。範囲外は -1。"""
+    i = np.rint((np.asarray(lat) - self.lat[0]) / self._dlat).astype(np.int64)
+    j = np.rint((np.asarray(lng) - self.lon[0]) / self._dlon).astype(np.int64)
+    outside = (i < 0) | (i >= len(self.lat)) | (j < 0) | (j >= len(self.lon))
+    return np.where(outside, -1, i), np.where(outside, -1, j)
+
+  def point(self, lat, lng):
+    """指定地点の全時刻の指数を返す。格子の範囲外なら None。"""
+    i, j = self._indices(lat, lng)
+    if i < 0:
+      return None
+    return {
+      "lat": float(self.lat[i]),
+      "lng": float(self.lon[j]),
+      "times": self.times,
+      **{name: [round(float(x), 3) for x in arr[:, i, j]] for name, arr in self.arrays.items()},
+    }
+
+  def tile(self, name, t, z, x, y):
+    """Web メルカトルの z/x/y タイルを PNG で返す。"""
+    if name not in self.arrays:
+      raise ValueError(f"未知の指数です: {name}")
+    values = self.arrays[name]
+    if not 0 <= t < values.shape[0]:
+      raise ValueError(f"時刻の番号が範囲外です: {t}")
+    n = TILE_SIZE * 2 ** z
+    px = (x * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / n
+    py = (y * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / n
+    lng = px * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * py))))
+    i, j = self._indices(lat[:, None], lng[None, :])
+    inside = i >= 0
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    if inside.any():
+      sampled = values[t][i[inside], j[inside]]
+      rgba[inside, :3] = _colorize(_badness(name, sampled))
+      rgba[inside, 3] = TILE_ALPHA
+    return _png(rgba)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="シーイング・透明度指数の計算と問い合わせ")
+  sub = parser.add_subparsers(dest="cmd", required=True)
+  c = sub.add_parser("compute", help="GRIB2 / NetCDF から指数を計算")
+  c.add_argument("source")
+  c.add_argument("out_dir")
+  c.add_argument("--workers", type=int)
+  p = sub.add_parser("point", help="地点の指数を表示")
+  p.add_argument("out_dir")
+  p.add_argument("lat", type=float)
+  p.add_argument("lng", type=float)
+  args = parser.parse_args(argv)
+
+  if args.cmd == "compute":
+    out = compute_indices(load_fields(args.source), args.out_dir, workers=args.workers)
+    print(f"{out} に保存しました")
+    return
+  result = IndexStore(args.out_dir).point(args.lat, args.lng)
+  if result is None:
+    print("格子の範囲外です")
+    return
+  for time_label, s, tr in zip(result["times"], result["seeing"], result["transparency"]):
+    print(f"{time_label}  シーイング {s:.2f}\"  透明度 {tr:.2f}")
+
+
+if __name__ == "__main__":
+  main()
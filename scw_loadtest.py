@@ -0,0 +1,543 @@
+"""
+scw_server.py / Streamlit 版の負荷試験ツール。
+N 人分のセッションを同時に走らせ、ページ読み込み・地図クリック相当の API 呼び出し・逆ジオコーディング・お気に入り同期を繰り返す。
+逆ジオコーディングとお気に入り同期はページ（ブラウザ）から直接呼ばれるもので、対象のサーバーを通らない。
+ローカルの偽アップストリームに向けてセッションの流れだけ再現し、計測結果は対象への要求（total）と分けて記録する。
+Streamlit 版（--kind streamlit）は、ブラウザと同じく /_stcore/stream の WebSocket セッションを張ってアプリのスクリプトを実行させる。
+Streamlit はこのセッション経由でしかスクリプトを実行しないため。メッセージの定義に streamlit パッケージが必要（server 版は標準ライブラリのみ）。
+使い方:
+  python scw_loadtest.py --launch "python scw_server.py --no-browser --port 8765 --graph road.graph" --target http://127.0.0.1:8765 --users 30
+  python scw_loadtest.py --kind streamlit --target http://127.0.0.1:8501 --pid 12345 --users 30 --label v1.2
+結果は loadtest_results/<日時>-<ラベル>.json に保存し、--compare で過去の結果と比べられる。
+"""
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import argparse
+import base64
+import json
+import os
+import random
+import shlex
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+RESULTS_DIR = Path(__file__).resolve().parent / "loadtest_results"
+# 地図クリックの座標を散らす範囲（日本付近）
+CLICK_BOUNDS = ((31.0, 43.0), (130.0, 145.0))
+FAKE_GEOCODE_DELAY_S = 0.05
+REQUEST_TIMEOUT_S = 30
+SAMPLE_INTERVAL_S = 0.5
+PERCENTILES = (50, 95, 99)
+# scw_server.py のローカル API（未設定で 503 を返すものは事前確認で外す）
+SERVER_STEPS = (
+  ("route", "POST", "/api/route"),
+  ("indices", "GET", "/api/indices/point"),
+  ("nowcast", "GET", "/api/nowcast"),
+)
+STREAMLIT_STREAM_PATH = "/_stcore/stream"
+
+
+# --- 偽アップストリーム ----------------------------------------------------
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+  """Nominatim の /reverse とお気に入り同期（/favorites/<ユーザー>）の代役。"""
+
+  def log_message(self, fmt, *args):
+    pass
+
+  def _send_json(self, status, obj):
+    body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json; charset=utf-8")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    if self.path.startswith("/reverse"):
+      time.sleep(FAKE_GEOCODE_DELAY_S)
+      self._send_json(200, {"display_name": "負荷試験用の地名, 日本"})
+    elif self.path.startswith("/favorites/"):
+      with self.server.lock:
+        favs = self.server.favorites.get(self.path, [])
+      self._send_json(200, favs)
+    else:
+      self._send_json(404, {"error": "not found"})
+
+  def do_PUT(self):
+    if not self.path.startswith("/favorites/"):
+      self._send_json(404, {"error": "not found"})
+      return
+    length = int(self.headers.get("Content-Length") or 0)
+    favs = json.loads(self.rfile.read(length) or b"[]")
+    with self.server.lock:
+      self.server.favorites[self.path] = favs
+    self._send_json(200, {"ok": True})
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+  daemon_threads = True
+  request_queue_size = 128
+
+
+def start_fake_upstream():
+  server = FakeUpstreamServer(("127.0.0.1", 0), FakeUpstreamHandler)
+  server.lock = threading.Lock()
+  server.favorites = {}
+  threading.Thread(target=server.serve_forever, name="fake-upstream", daemon=True).start()
+  return server
+
+
+# --- 計測 -----------------------------------------------------------------
+
+class Recorder:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.latencies = {}
+    self.errors = {}
+    # 偽アップストリームへの要求。対象の性能ではないので total には含めない
+    self.upstream_steps = set()
+
+  def add(self, step, seconds, ok, upstream=False):
+    with self.lock:
+      self.latencies.setdefault(step, []).append(seconds)
+      if not ok:
+        self.errors[step] = self.errors.get(step, 0) + 1
+      if upstream:
+        self.upstream_steps.add(step)
+
+
+def percentile(sorted_values, p):
+  if not sorted_values:
+    return None
+  k = (len(sorted_values) - 1) * p / 100
+  lo = int(k)
+  hi = min(lo + 1, len(sorted_values) - 1)
+  return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(values, errors, wall):
+  values = sorted(values)
+  stats = {f"p{p}_ms": round(percentile(values, p) * 1000, 1) for p in PERCENTILES} if values else {}
+  stats.update({
+    "requests": len(values),
+    "errors": errors,
+    "throughput_rps": round(len(values) / wall, 2) if wall else 0.0,
+  })
+  return stats
+
+
+def _proc_tree(root_pid):
+  """root_pid とその子孫のプロセス ID（Linux の /proc を使う）。"""
+  children = {}
+  for entry in os.listdir("/proc"):
+    if not entry.isdigit():
+      continue
+    try:
+      stat = Path(f"/proc/{entry}/stat").read_text()
+    except OSError:
+      continue
+    ppid = int(stat.rsplit(")", 1)[1].split()[1])
+    children.setdefault(ppid, []).append(int(entry))
+  pids = [root_pid]
+  for pid in pids:
+    pids.extend(children.get(pid, []))
+  return pids
+
+
+def _proc_sample(pid):
+  """(RSS バイト, CPU 秒) を返す。プロセスが消えていれば None。"""
+  try:
+    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    status = Path(f"/proc/{pid}/status").read_text()
+  except OSError:
+    return None
+  ticks = os.sysconf("SC_CLK_TCK")
+  cpu = (int(fields[11]) + int(fields[12])) / ticks
+  rss = 0
+  for line in status.splitlines():
+    if line.startswith("VmRSS:"):
+      rss = int(line.split()[1]) * 1024
+  return rss, cpu
+
+
+class ProcessSampler(threading.Thread):
+  """対象プロセス（子プロセスを含む）の RSS と CPU 使用率を定期的に記録する。"""
+
+  def __init__(self, pid, interval=SAMPLE_INTERVAL_S):
+    super().__init__(name="process-sampler", daemon=True)
+    self.pid = pid
+    self.interval = interval
+    self.samples = {}
+    self._stopped = threading.Event()
+
+  def run(self):
+    prev = {}
+    prev_t = time.monotonic()
+    while not self._stopped.wait(self.interval):
+      now = time.monotonic()
+      for pid in _proc_tree(self.pid):
+        sample = _proc_sample(pid)
+        if sample is None:
+          continue
+        rss, cpu = sample
+        rec = self.samples.setdefault(pid, {"rss": [], "cpu_percent": []})
+        rec["rss"].append(rss)
+        if pid in prev:
+          rec["cpu_percent"].append(100 * (cpu - prev[pid]) / (now - prev_t))
+        prev[pid] = cpu
+      prev_t = now
+
+  def stop(self):
+    self._stopped.set()
+    self.join()
+
+  def report(self):
+    out = {}
+    for pid, rec in self.samples.items():
+      cpu = rec["cpu_percent"]
+      out[str(pid)] = {
+        "rss_peak_mb": round(max(rec["rss"]) / 2**20, 1),
+        "rss_mean_mb": round(sum(rec["rss"]) / len(rec["rss"]) / 2**20, 1),
+        "cpu_mean_percent": round(sum(cpu) / len(cpu), 1) if cpu else None,
+        "cpu_peak_percent": round(max(cpu), 1) if cpu else None,
+      }
+    return out
+
+
+# --- Streamlit の WebSocket セッション --------------------------------------
+
+def _streamlit_protos():
+  try:
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+  except ImportError:
+    raise SystemExit("--kind streamlit には streamlit パッケージ（メッセージの protobuf 定義）が必要です") from None
+  return BackMsg, ForwardMsg
+
+
+class StreamlitSession:
+  """/_stcore/stream に WebSocket（RFC 6455）でつなぎ、ブラウザの代わりにスクリプトを実行させる最小限のクライアント。"""
+
+  def __init__(self, target):
+    self.BackMsg, self.ForwardMsg = _streamlit_protos()
+    url = urllib.parse.urlsplit(target)
+    self.sock = socket.create_connection((url.hostname, url.port or 80), timeout=REQUEST_TIMEOUT_S)
+    self.rfile = self.sock.makefile("rb")
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    self.sock.sendall((
+      f"GET {url.path.rstrip('/')}{STREAMLIT_STREAM_PATH} HTTP/1.1\r\n"
+      f"Host: {url.netloc}\r\n"
+      "Upgrade: websocket\r\n"
+      "Connection: Upgrade\r\n"
+      f"Sec-WebSocket-Key: {key}\r\n"
+      "Sec-WebSocket-Version: 13\r\n"
+      "Sec-WebSocket-Protocol: streamlit\r\n\r\n"
+    ).encode("ascii"))
+    status = self.rfile.readline()
+    while self.rfile.readline() not in (b"\r\n", b""):
+      pass
+    if b" 101 " not in status:
+      self.close()
+      raise ConnectionError(f"WebSocket に切り替えられませんでした: {status.decode('latin-1').strip()}")
+
+  def _read(self, n):
+    data = self.rfile.read(n)
+    if len(data) < n:
+      raise ConnectionError("Streamlit との接続が切れました")
+    return data
+
+  def _send(self, opcode, payload):
+    # クライアントからのフレームは必ずマスクする
+    mask = os.urandom(4)
+    n = len(payload)
+    if n < 126:
+      header = struct.pack(">BB", 0x80 | opcode, 0x80 | n)
+    elif n < 1 << 16:
+      header = struct.pack(">BBH", 0x80 | opcode, 0x80 | 126, n)
+    else:
+      header = struct.pack(">BBQ", 0x80 | opcode, 0x80 | 127, n)
+    masked = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+    self.sock.sendall(header + mask + masked)
+
+  def _recv(self):
+    """次のデータメッセージ（分割されていれば連結したもの）を返す。ping には pong を返す。"""
+    data = b""
+    while True:
+      b0, b1 = self._read(2)
+      opcode = b0 & 0x0F
+      n = b1 & 0x7F
+      if n == 126:
+        (n,) = struct.unpack(">H", self._read(2))
+      elif n == 127:
+        (n,) = struct.unpack(">Q", self._read(8))
+      payload = self._read(n)
+      if opcode == 0x8:
+        raise ConnectionError("Streamlit がセッションを閉じました")
+      if opcode == 0x9:
+        self._send(0xA, payload)
+        continue
+      if opcode == 0xA:
+        continue
+      data += payload
+      if b0 & 0x80:
+        return data
+
+  def run_script(self):
+    """ブラウザの読み込み・ウィジェット操作と同じくスクリプトを実行させ、終わるまで待つ。正常終了なら True。"""
+    msg = self.BackMsg()
+    msg.rerun_script.SetInParent()
+    self._send(0x2, msg.SerializeToString())
+    while True:
+      fwd = self.ForwardMsg.FromString(self._recv())
+      if fwd.WhichOneof("type") == "script_finished":
+        return fwd.script_finished in (
+          self.ForwardMsg.FINISHED_SUCCESSFULLY, self.ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+        )
+
+  def close(self):
+    try:
+      self._send(0x8, struct.pack(">H", 1000))
+    except OSError:
+      pass
+    self.rfile.close()
+    self.sock.close()
+
+
+# --- セッション -----------------------------------------------------------
+
+def _request(method, url, body=None):
+  data = json.dumps(body).encode("utf-8") if body is not None else None
+  req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+  try:
+    with urllib.request.urlopen(req, timeout=REQUEST_TIMEOUT_S) as res:
+      res.read()
+      return res.status
+  except urllib.error.HTTPError as e:
+    return e.code
+  except (urllib.error.URLError, OSError):
+    return 0
+
+
+def probe_server_steps(target):
+  """設定されていて応答するローカル API だけを返す。"""
+  lat, lng = 36.0, 138.0
+  enabled = []
+  for name, method, path in SERVER_STEPS:
+    if method == "POST":
+      status = _request(method, target + path, {"lat": lat, "lng": lng, "favorites": []})
+    else:
+      status = _request(method, f"{target}{path}?lat={lat}&lng={lng}")
+    if status not in (0, 404, 503):
+      enabled.append((name, method, path))
+  return enabled
+
+
+def run_session(user_id, args, upstream, steps, recorder, deadline):
+  """1 セッション: ページ読み込み → クリックを繰り返す（逆ジオ・ローカル API・お気に入り同期）。
+
+  Streamlit 版は WebSocket セッションでスクリプトを実行させ、クリックごとに再実行する（ウィジェット操作・再読み込み相当）。
+  """
+  rng = random.Random(args.seed + user_id)
+  favorites = []
+  fav_url = f"{upstream}/favorites/user{user_id}"
+
+  def measure(step, fn, upstream_step=False):
+    t0 = time.perf_counter()
+    try:
+      result = fn()
+      ok = result is not False
+    except OSError:
+      result, ok = None, False
+    recorder.add(step, time.perf_counter() - t0, ok, upstream=upstream_step)
+    return result
+
+  def timed(step, method, url, body=None, upstream_step=False):
+    measure(step, lambda: 200 <= _request(method, url, body) < 400, upstream_step)
+
+  timed("page", "GET", args.target + "/")
+  session = None
+  if args.kind == "streamlit":
+    session = measure("ws_connect", lambda: StreamlitSession(args.target))
+    if session:
+      measure("script_run", session.run_script)
+  timed("favorites_get", "GET", fav_url, upstream_step=True)
+  clicks = 0
+  try:
+    while clicks < args.clicks and time.monotonic() < deadline:
+      lat = rng.uniform(*args.area[0])
+      lng = rng.uniform(*args.area[1])
+      timed("geocode", "GET", f"{upstream}/reverse?format=jsonv2&lat={lat}&lon={lng}", upstream_step=True)
+      for name, method, path in steps:
+        if method == "POST":
+          timed(name, method, args.target + path, {"lat": lat, "lng": lng, "favorites": favorites})
+        else:
+          timed(name, method, f"{args.target}{path}?lat={lat}&lng={lng}")
+      if session:
+        measure("script_run", session.run_script)
+      if rng.random() < args.fav_rate and len(favorites) < 30:
+        favorites.append({"name": f"地点{clicks}", "lat": lat, "lng": lng})
+        timed("favorites_put", "PUT", fav_url, favorites, upstream_step=True)
+      clicks += 1
+      if args.think > 0:
+        time.sleep(rng.uniform(0, 2 * args.think))
+  finally:
+    if session:
+      session.close()
+
+
+def wait_ready(url, timeout):
+  end = time.monotonic() + timeout
+  while time.monotonic() < end:
+    if _request("GET", url) == 200:
+      return True
+    time.sleep(0.2)
+  return False
+
+
+def _git_revision():
+  try:
+    out = subprocess.run(
+      ["git", "describe", "--always", "--dirty"], cwd=Path(__file__).resolve().parent,
+      capture_output=True, text=True, check=True,
+    )
+    return out.stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def compare(current, previous):
+  """total とステップごとの p95 とスループットの変化を表示する。"""
+  print(f"比較対象: {previous.get('label')} ({previous.get('revision')}, {previous.get('started_at')})")
+  if previous.get("total_scope") != current["total_scope"]:
+    print("  ※ 比較対象の total は偽アップストリームへの要求を含む古い形式なので、ステップ単位で比べてください")
+  for step, stats in [("total", current["total"]), *current["steps"].items()]:
+    if step == "total" and previous.get("total_scope") != current["total_scope"]:
+      continue
+    old = previous.get("total") if step == "total" else previous.get("steps", {}).get(step)
+    if not old or "p95_ms" not in stats or "p95_ms" not in old:
+      continue
+    d95 = stats["p95_ms"] - old["p95_ms"]
+    drps = stats["throughput_rps"] - old["throughput_rps"]
+    print(f"  {step:16s} p95 {old['p95_ms']:8.1f} → {stats['p95_ms']:8.1f} ms ({d95:+.1f})  rps {drps:+.2f}")
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="scw_picker の負荷試験")
+  parser.add_argument("--target", default="http://127.0.0.1:8765", help="対象のベース URL")
+  parser.add_argument("--kind", choices=("server", "streamlit"), default="server")
+  parser.add_argument("--users", type=int, default=20, help="同時セッション数")
+  parser.add_argument("--clicks", type=int, default=20, help="1 セッションあたりのクリック数")
+  parser.add_argument("--duration", type=float, default=120, help="最大実行時間（秒）")
+  parser.add_argument("--think", type=float, default=0.5, help="クリック間の平均待ち時間（秒）")
+  parser.add_argument("--fav-rate", type=float, default=0.2, help="クリック後にお気に入りを同期する確率")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--area", help="クリック範囲 南端,北端,西端,東端（既定: 日本付近）")
+  parser.add_argument("--launch", help="対象プロセスをこのコマンドで起動して計測する")
+  parser.add_argument("--pid", type=int, help="計測する既存プロセスの PID")
+  parser.add_argument("--label", default="run")
+  parser.add_argument("--out", help="結果 JSON の保存先（既定: loadtest_results/）")
+  parser.add_argument("--compare", help="比較する過去の結果 JSON")
+  args = parser.parse_args(argv)
+  args.target = args.target.rstrip("/")
+  if args.area:
+    s, n, w, e = (float(x) for x in args.area.split(","))
+    args.area = ((s, n), (w, e))
+  else:
+    args.area = CLICK_BOUNDS
+
+  proc = None
+  pid = args.pid
+  if args.launch:
+    proc = subprocess.Popen(shlex.split(args.launch))
+    pid = proc.pid
+  try:
+    if not wait_ready(args.target + "/", timeout=60):
+      print(f"{args.target} に接続できません", file=sys.stderr)
+      sys.exit(1)
+    if args.kind == "streamlit":
+      _streamlit_protos()
+    upstream_server = start_fake_upstream()
+    upstream = f"http://127.0.0.1:{upstream_server.server_address[1]}"
+    steps = probe_server_steps(args.target) if args.kind == "server" else []
+    print(f"{args.users} セッション、ローカル API: {', '.join(s[0] for s in steps) or 'なし'}")
+
+    sampler = None
+    if pid and Path("/proc").is_dir():
+      sampler = ProcessSampler(pid)
+      sampler.start()
+    recorder = Recorder()
+    started_at = datetime.now().isoformat(timespec="seconds")
+    t0 = time.monotonic()
+    deadline = t0 + args.duration
+    threads = [
+      threading.Thread(target=run_session, args=(i, args, upstream, steps, recorder, deadline), daemon=True)
+      for i in range(args.users)
+    ]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    wall = time.monotonic() - t0
+    if sampler:
+      sampler.stop()
+    upstream_server.shutdown()
+  finally:
+    if proc:
+      proc.terminate()
+      proc.wait(timeout=10)
+
+  target_steps = {k: v for k, v in recorder.latencies.items() if k not in recorder.upstream_steps}
+  upstream_steps = {k: v for k, v in recorder.latencies.items() if k in recorder.upstream_steps}
+  target_latencies = [v for vals in target_steps.values() for v in vals]
+  target_errors = sum(n for step, n in recorder.errors.items() if step in target_steps)
+  result = {
+    "label": args.label,
+    "revision": _git_revision(),
+    "started_at": started_at,
+    "target": args.target,
+    "kind": args.kind,
+    "users": args.users,
+    "clicks": args.clicks,
+    "think_s": args.think,
+    "wall_s": round(wall, 2),
+    # total は --target への要求だけ（偽アップストリームは upstream に分ける）
+    "total_scope": "target",
+    "total": summarize(target_latencies, target_errors, wall),
+    "steps": {step: summarize(vals, recorder.errors.get(step, 0), wall) for step, vals in target_steps.items()},
+    "upstream": {step: summarize(vals, recorder.errors.get(step, 0), wall) for step, vals in upstream_steps.items()},
+    "processes": sampler.report() if sampler else {},
+  }
+
+  print(f"{'step':16s} {'reqs':>6s} {'err':>5s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'rps':>7s}")
+  rows = [("total", result["total"]), *result["steps"].items()]
+  rows += [(f"({step})", s) for step, s in result["upstream"].items()]
+  for step, s in rows:
+    if not s["requests"]:
+      continue
+    print(f"{step:16s} {s['requests']:6d} {s['errors']:5d} {s['p50_ms']:8.1f} {s['p95_ms']:8.1f} {s['p99_ms']:8.1f} {s['throughput_rps']:7.2f}")
+  if result["upstream"]:
+    print("（括弧付きは偽アップストリームへの要求で、total に含まない）")
+  for p, s in result["processes"].items():
+    print(f"pid {p}: RSS peak {s['rss_peak_mb']} MB, CPU mean {s['cpu_mean_percent']}% / peak {s['cpu_peak_percent']}%")
+
+  out = Path(args.out) if args.out else RESULTS_DIR / f"{datetime.now():%Y%m%dT%H%M%S}-{args.label}.json"
+  out.parent.mkdir(parents=True, exist_ok=True)
+  out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+  print(f"結果を {out} に保存しました")
+  if args.compare:
+    compare(result, json.loads(Path(args.compare).read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,337 @@
+"""
+雲量（雲マスク）画像の直近フレームを固定長のリングバッファに保持し、地点の時系列と短時間予測（ナウキャスト）を返す。
+フレームはローカルの取得スクリプトが置いたファイル（.npy または 8bit PGM、0〜100 の雲量、255 は欠測）を取り込む。
+使い方:
+  python scw_nowcast.py init ring/ --capacity 144 --shape 600x800 --bounds 46,24,122,150
+  python scw_nowcast.py ingest ring/ drop/ [--watch 60]
+  python scw_nowcast.py point ring/ 36.1 138.2
+ファイル名は 20261019T1230Z.npy のように UTC 時刻にする（読めない場合は更新時刻を使う）。
+書き込み中のファイルは更新から INGEST_SETTLE_S 秒待ってから取り込み、壊れたファイルは警告を出して飛ばす。
+必要ライブラリ: numpy
+"""
+
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import json
+import math
+import re
+import sys
+import time
+
+import numpy as np
+
+
+MISSING = 255
+FRAME_SUFFIXES = (".npy", ".pgm")
+TIME_FORMATS = ("%Y%m%dT%H%MZ", "%Y%m%dT%H%M", "%Y%m%d%H%M")
+# 動きの推定に使う、地点まわりの切り出しサイズ（画素）
+MOTION_WINDOW = 128
+REGION_RADIUS_KM = 10.0
+NOWCAST_STEPS = 6
+NOWCAST_STEP_MINUTES = 30
+KM_PER_DEG = 111.32
+PGM_HEADER = re.compile(rb"P5\s+(\d+)\s+(\d+)\s+(\d+)\s")
+# 更新からこの秒数が経っていないファイルは、取得スクリプトが書き込み中とみなして次回に回す
+INGEST_SETTLE_S = 5.0
+# 読み取り中に書き手が進んだときに読み直す回数
+SNAPSHOT_RETRIES = 5
+
+
+def _frame_time(path):
+  for fmt in TIME_FORMATS:
+    try:
+      dt = datetime.strptime(path.stem, fmt).replace(tzinfo=timezone.utc)
+      return int(dt.timestamp())
+    except ValueError:
+      continue
+  return int(path.stat().st_mtime)
+
+
+def _open_frame(path):
+  """フレームファイルをメモリマップで開く（コピーしない）。"""
+  if path.suffix == ".npy":
+    return np.load(path, mmap_mode="r")
+  with open(path, "rb") as f:
+    header = f.read(64)
+  # P5 <幅> <高さ> <最大値> の後に 1 バイトの空白を挟んで画素が続く
+  m = PGM_HEADER.match(header)
+  if m is None or int(m.group(3)) > 255:
+    raise ValueError(f"{path} は 8bit バイナリ PGM ではありません")
+  w, h = int(m.group(1)), int(m.group(2))
+  return np.memmap(path, dtype=np.uint8, mode="r", offset=m.end(), shape=(h, w))
+
+
+def _iso(ts):
+  return datetime.fromtimestamp(int(ts), timezone.utc).strftime("%Y-%m-%dT%H:%MZ")
+
+
+class FrameRing:
+  """(容量, 高さ, 幅) の uint8 メモリマップに上書きで積んでいくリングバッファ。
+
+  frames.npy / times.npy / state.npy（[これまでに書いたフレーム数]）と meta.json（格子の範囲）からなる。
+  書き手は 1 プロセスだけで、フレームを書き終えてから state の 1 語を進めて公開する。
+  読み手は次の書き込み先（満杯なら最古のスロット）を使わず、読んでいる間に state が変わったら読み直す（seqlock）。
+  そのため読めるのは最大で容量 - 1 フレーム。
+  """
+
+  def __init__(self, directory, mode="r"):
+    self.directory = Path(directory)
+    self.meta = json.loads((self.directory / "meta.json").read_text(encoding="utf-8"))
+    mm = "r+" if mode == "w" else "r"
+    self.frames = np.load(self.directory / "frames.npy", mmap_mode=mm)
+    self.times = np.load(self.directory / "times.npy", mmap_mode=mm)
+    self.state = np.load(self.directory / "state.npy", mmap_mode=mm)
+    if self.state.shape != (1,):
+      raise ValueError(f"{self.directory} は古い形式のリングバッファです。init で作り直してください")
+    self.capacity, self.height, self.width = self.frames.shape
+    self.north, self.south, self.west, self.east = self.meta["bounds"]
+
+  @classmethod
+  def create(cls, directory, capacity, height, width, bounds):
+    """空のリングを作る。bounds は (北端, 南端, 西端, 東端)。"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    np.lib.format.open_memmap(directory / "frames.npy", mode="w+", dtype=np.uint8, shape=(capacity, height, width))[:] = MISSING
+    np.lib.format.open_memmap(directory / "times.npy", mode="w+", dtype=np.int64, shape=(capacity,))[:] = 0
+    np.lib.format.open_memmap(directory / "state.npy", mode="w+", dtype=np.int64, shape=(1,))[:] = 0
+    meta = {"capacity": capacity, "shape": [height, width], "bounds": [float(b) for b in bounds]}
+    (directory / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return cls(directory, mode="w")
+
+  @property
+  def count(self):
+    return min(int(self.state[0]), self.capacity - 1)
+
+  @property
+  def latest_time(self):
+    seq = int(self.state[0])
+    if seq == 0:
+      return None
+    return int(self.times[(seq - 1) % self.capacity])
+
+  def push(self, frame, timestamp):
+    """フレームを次のスロットへ上書きコピーする（新しい配列は確保しない）。"""
+    if frame.shape != (self.height, self.width):
+      raise ValueError(f"フレームの大きさが違います: {frame.shape} != {(self.height, self.width)}")
+    seq = int(self.state[0])
+    slot = seq % self.capacity
+    np.copyto(self.frames[slot], frame, casting="unsafe")
+    self.times[slot] = timestamp
+    self.frames.flush()
+    self.times.flush()
+    # 画素と時刻を書き終えてから 1 語だけ進めて公開する
+    self.state[0] = seq + 1
+    self.state.flush()
+
+  def ingest(self, drop_dir, settle_seconds=INGEST_SETTLE_S):
+    """drop_dir のフレームのうち、最新より新しいものを時刻順に取り込む。取り込んだ枚数を返す。
+
+    更新から settle_seconds 経っていないファイルに当たったら、順序を崩さないようそこで止めて次回に回す。
+    開けないファイル（書きかけ・壊れている・大きさが違う）は警告を出して飛ばす。
+    """
+    latest = self.latest_time or 0
+    pending = []
+    for p in Path(drop_dir).iterdir():
+      if p.suffix not in FRAME_SUFFIXES:
+        continue
+      try:
+        ts = _frame_time(p)
+        mtime = p.stat().st_mtime
+      except OSError:
+        # 列挙した後に取得スクリプトが消した・置き換えた
+        continue
+      if ts > latest:
+        pending.append((ts, mtime, p))
+    pending.sort()
+    now = time.time()
+    count = 0
+    for ts, mtime, p in pending:
+      if now - mtime < settle_seconds:
+        break
+      try:
+        self.push(_open_frame(p), ts)
+      except (OSError, ValueError, EOFError) as e:
+        print(f"{p.name} を取り込めないので飛ばします: {e}", file=sys.stderr)
+        continue
+      count += 1
+    return count
+
+  def _order(self, seq, hours=None):
+    """seq 時点で読んでよいスロット番号（古い順）。hours を指定すると最新から hours 時間以内に絞る。"""
+    count = min(seq, self.capacity - 1)
+    order = (seq - count + np.arange(count)) % self.capacity
+    if hours is not None and count:
+      order = order[self.times[order] >= self.times[order[-1]] - hours * 3600]
+    return order
+
+  def _snapshot(self, read, hours=None):
+    """read(order) を、読んでいる間に書き手が進まなかったときの結果で返す。
+
+    read の中では必ずコピーを作ること（メモリマップのビューを返すと、後で上書きされうる）。
+    """
+    for _ in range(SNAPSHOT_RETRIES):
+      seq = int(self.state[0])
+      result = read(self._order(seq, hours))
+      if int(self.state[0]) == seq:
+        return result
+    raise TimeoutError("雲量フレームの更新が続いていて読み取れません")
+
+  def pixel(self, lat, lng):
+    """緯度経度を画素位置 (行, 列) にする。範囲外は None。"""
+    y = (self.north - lat) / (self.north - self.south) * self.height
+    x = (lng - self.west) / (self.east - self.west) * self.width
+    if not (0 <= y < self.height and 0 <= x < self.width):
+      return None
+    return int(y), int(x)
+
+  def series(self, lat, lng, hours=None):
+    """地点の雲量の時系列（古い順）。欠測は None。"""
+    pos = self.pixel(lat, lng)
+    if pos is None:
+      return None
+    times, values = self._snapshot(lambda order: (self.times[order], self.frames[order, pos[0], pos[1]]), hours)
+    return {
+      "times": [_iso(t) for t in times],
+      "values": [None if v == MISSING else int(v) for v in values],
+    }
+
+  def region(self, lat, lng, radius_km=REGION_RADIUS_KM, hours=None):
+    """地点を中心とした矩形領域の平均雲量の時系列（古い順）。"""
+    pos = self.pixel(lat, lng)
+    if pos is None:
+      return None
+    dy = radius_km / KM_PER_DEG / (self.north - self.south) * self.height
+    dx = radius_km / (KM_PER_DEG * math.cos(math.radians(lat))) / (self.east - self.west) * self.width
+    r0, r1 = max(0, pos[0] - math.ceil(dy)), min(self.height, pos[0] + math.ceil(dy) + 1)
+    c0, c1 = max(0, pos[1] - math.ceil(dx)), min(self.width, pos[1] + math.ceil(dx) + 1)
+    # 整数配列での添字はコピーになる
+    block = np.ma.masked_equal(self._snapshot(lambda order: self.frames[order, r0:r1, c0:c1], hours), MISSING)
+    means = block.mean(axis=(1, 2))
+    return [None if np.ma.is_masked(m) else round(float(m), 1) for m in means]
+
+  def _motion(self, order, pos, window):
+    """order の直近 2 フレームの位相相関から、pos まわりの雲の移動量（画素/秒）を推定する。"""
+    if len(order) < 2:
+      return None
+    a_slot, b_slot = order[-2], order[-1]
+    dt = int(self.times[b_slot] - self.times[a_slot])
+    if dt <= 0:
+      return None
+    half = window // 2
+    r0, c0 = max(0, pos[0] - half), max(0, pos[1] - half)
+    r1, c1 = min(self.height, r0 + window), min(self.width, c0 + window)
+    a = self.frames[a_slot, r0:r1, c0:c1].astype(np.float32)
+    b = self.frames[b_slot, r0:r1, c0:c1].astype(np.float32)
+    valid = (a != MISSING) & (b != MISSING)
+    if valid.mean() < 0.5:
+      return None
+    a = np.where(valid, a - a[valid].mean(), 0)
+    b = np.where(valid, b - b[valid].mean(), 0)
+    taper = np.outer(np.hanning(a.shape[0]), np.hanning(a.shape[1]))
+    fa = np.fft.rfft2(a * taper)
+    fb = np.fft.rfft2(b * taper)
+    cross = fb * np.conj(fa)
+    cross /= np.maximum(np.abs(cross), 1e-9)
+    corr = np.fft.irfft2(cross, s=a.shape)
+    sy, sx = np.unravel_index(np.argmax(corr), corr.shape)
+    # 位相相関のピークは巡回しているので、半分を超えたら負の移動とみなす
+    sy = sy - corr.shape[0] if sy > corr.shape[0] // 2 else sy
+    sx = sx - corr.shape[1] if sx > corr.shape[1] // 2 else sx
+    return sy / dt, sx / dt
+
+  def motion(self, lat, lng, window=MOTION_WINDOW):
+    """直近 2 フレームの位相相関から、地点まわりの雲の移動量（画素/秒）を推定する。"""
+    pos = self.pixel(lat, lng)
+    if pos is None:
+      return None
+    return self._snapshot(lambda order: self._motion(order, pos, window))
+
+  def nowcast(self, lat, lng, steps=NOWCAST_STEPS, step_minutes=NOWCAST_STEP_MINUTES):
+    """最新フレームを推定した動きで後方移流し、地点の雲量を steps 先まで外挿する。"""
+    pos = self.pixel(lat, lng)
+    if pos is None:
+      return None
+    lead = np.arange(1, steps + 1) * step_minutes * 60
+
+    def read(order):
+      vel = self._motion(order, pos, MOTION_WINDOW)
+      if vel is None:
+        return None
+      latest = order[-1]
+      rows = np.rint(pos[0] - vel[0] * lead).astype(np.int64)
+      cols = np.rint(pos[1] - vel[1] * lead).astype(np.int64)
+      inside = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+      values = np.full(steps, MISSING, dtype=np.int64)
+      values[inside] = self.frames[latest, rows[inside], cols[inside]]
+      return int(self.times[latest]), vel, values
+
+    result = self._snapshot(read)
+    if result is None:
+      return None
+    t0, vel, values = result
+    return {
+      "times": [_iso(t0 + s) for s in lead],
+      "values": [None if v == MISSING else int(v) for v in values],
+      "motion_px_per_hour": [round(vel[0] * 3600, 2), round(vel[1] * 3600, 2)],
+    }
+
+  def summary(self, lat, lng, hours=12):
+    """ページのスパークライン用に、時系列・領域平均・ナウキャストをまとめて返す。"""
+    series = self.series(lat, lng, hours=hours)
+    if series is None:
+      return None
+    return {
+      **series,
+      "region": self.region(lat, lng, hours=hours),
+      "nowcast": self.nowcast(lat, lng),
+    }
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="雲量フレームのリングバッファとナウキャスト")
+  sub = parser.add_subparsers(dest="cmd", required=True)
+  i = sub.add_parser("init", help="空のリングバッファを作る")
+  i.add_argument("ring")
+  i.add_argument("--capacity", type=int, default=144)
+  i.add_argument("--shape", required=True, help="高さx幅（例: 600x800）")
+  i.add_argument("--bounds", required=True, help="北端,南端,西端,東端（度）")
+  g = sub.add_parser("ingest", help="フレームを取り込む")
+  g.add_argument("ring")
+  g.add_argument("drop_dir")
+  g.add_argument("--watch", type=float, help="指定秒ごとに取り込みを繰り返す")
+  p = sub.add_parser("point", help="地点の時系列とナウキャストを表示")
+  p.add_argument("ring")
+  p.add_argument("lat", type=float)
+  p.add_argument("lng", type=float)
+  p.add_argument("--hours", type=float, default=12)
+  args = parser.parse_args(argv)
+
+  if args.cmd == "init":
+    h, w = (int(x) for x in args.shape.lower().split("x"))
+    bounds = [float(x) for x in args.bounds.split(",")]
+    FrameRing.create(args.ring, args.capacity, h, w, bounds)
+    print(f"{args.ring} を作成しました（{args.capacity} フレーム, {h}x{w}）")
+  elif args.cmd == "ingest":
+    ring = FrameRing(args.ring, mode="w")
+    while True:
+      try:
+        n = ring.ingest(args.drop_dir)
+      except OSError as e:
+        # 取り込み元のディレクトリが一時的に見えない（ネットワークドライブなど）
+        if not args.watch:
+          raise
+        print(f"取り込みに失敗しました: {e}", file=sys.stderr)
+        n = 0
+      if n:
+        print(f"{n} フレームを取り込みました（最新 {_iso(ring.latest_time)}）")
+      if not args.watch:
+        break
+      time.sleep(args.watch)
+  else:
+    result = FrameRing(args.ring).summary(args.lat, args.lng, hours=args.hours)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+  main()
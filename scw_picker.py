@@ -2,6 +2,9 @@
 Leaflet で座標を選び、各サイトを開くボタンを提供するツール。
 対象: SCW / ClearOutside / Windy（ECMWF・GFS・JMA MSM・ICON、4分割は別ウィンドウ）/ LightPollutionMap / Stellarium / meteoblue
 機能: 地名表示（Nominatim逆ジオ）、お気に入り登録・呼び出し（最大10件、localStorage保存）、ライト/ダーク切替、サイトボタン並び替え保存
+先読み: お気に入りにポインタを乗せる/フォーカスすると、アイドル時間に地名・地図タイル・リンクを温めておく（window.scwPrefetch.stats で命中数を確認できる）
+オフライン: HTTP で配信すると Service Worker（SERVICE_WORKER_JS）がアプリ本体・地図タイル・地名をキャッシュし、電波のない観測地でも動く
+ローカル機能: scw_server.py 経由で開くと、お気に入りまでのドライブ時間と等時間線（1h/2h/3h）、シーイング・透明度の地点値と地図レイヤー、雲量の推移（スパークライン）と短時間予測、予報アーカイブの成績から選んだ推奨モデルを表示できる
 """
 
 from pathlib import Path
@@ -58,10 +61,13 @@ HTML = """<!DOCTYPE html>
     .fav-item { display: flex; align-items: center; gap: 4px; border: 1px solid var(--border); border-radius: 4px; padding: 4px 6px; background: var(--bg); }
     .fav-item.dragging { opacity: 0.6; border-style: dashed; }
     .fav-name { font-size: 0.95em; }
+    .fav-drive { font-size: 0.85em; color: var(--accent); }
+    .sparkline { vertical-align: middle; background: var(--code-bg); border-radius: 4px; }
     .fav-del { padding: 2px 4px; font-size: 0.6em; background: #ef4444; border: none; color: #fff; }
     input[type="text"] { padding: 6px; width: 240px; max-width: 100%; background: var(--bg); color: var(--fg); border: 1px solid var(--border); border-radius: 4px; }
     .site-buttons { display: flex; flex-wrap: wrap; gap: 6px; }
     .btn-drag.dragging { opacity: 0.6; border: 1px dashed var(--border); }
+    .btn-drag.recommended { box-shadow: 0 0 0 2px #22c55e; }
     .fav-tools { display: flex; gap: 8px; flex-wrap: wrap; align-items: center; }
     .calendar-btn { background: #2563eb; color: #fff; border: 1px solid #1d4ed8; padding: 8px 12px; border-radius: 4px; text-decoration: none; display: inline-block; }
     .calendar-btn:hover { background: #1d4ed8; }
@@ -103,6 +109,27 @@ HTML = """<!DOCTYPE html>
       <button id="open-meteoblue" class="btn-drag" disabled>meteoblue</button>
       <button id="open-windy-quad" class="btn-drag" disabled>Windy 3分割</button>
     </div>
+    <div class="row">
+      <button id="route-btn" class="secondary" type="button" disabled>ドライブ時間・等時間線</button>
+      <code id="route-status">scw_server.py で開くと利用できます</code>
+    </div>
+    <div class="row">
+      シーイング/透明度:
+      <select id="idx-time" disabled></select>
+      <code id="idx-point">scw_server.py で開くと利用できます</code>
+    </div>
+    <div class="row">
+      雲量の推移: <span id="nowcast-spark"></span>
+      <code id="nowcast-status">scw_server.py で開くと利用できます</code>
+    </div>
+    <div class="row">
+      実績の推奨モデル:
+      <code id="skill-model">scw_server.py で開くと利用できます</code>
+    </div>
+    <div class="row">
+      <button id="offline-download" class="secondary" type="button" disabled>この周辺をオフライン用に保存</button>
+      <code id="offline-status">scw_server.py（HTTP）で開くとオフライン対応になります</code>
+    </div>
     <div class="row">
       <input id="fav-name" type="text" placeholder="お気に入り名（空なら地名か座標）" />
       <button id="fav-save" disabled>お気に入りに追加 (最大30件)</button>
@@ -127,6 +154,10 @@ HTML = """<!DOCTYPE html>
         <li>お気に入りは最大10件。名称未入力なら地名→座標の順で自動設定。削除は各行の削除ボタン。</li>
         <li>ライト/ダーク切替はブラウザに保存され、再訪時に復元されます。</li>
         <li>サイトボタンはドラッグで並び替えでき、順序は保存されます。</li>
+        <li>ドライブ時間・等時間線は scw_server.py（ローカル道路グラフ）で開いた場合のみ使えます。</li>
+        <li>シーイング/透明度は scw_server.py --indices で開いた場合のみ使えます。地図右上のレイヤー切替で重ね表示できます。</li>
+        <li>雲量の推移は scw_server.py --nowcast で開いた場合のみ使えます。実線が直近の実況、破線が雲の動きからの短時間予測です。</li>
+        <li>scw_server.py で開くと、一度表示した地図・地名はオフラインでも使えます。出かける前に「この周辺をオフライン用に保存」で選択地点の周辺タイルを保存できます（OSM の利用規約に合わせ、ズーム16まで・枚数に上限あり・保存は30分に1回までです）。</li>
         <li>Windy埋め込みはJMA MSMの分割表示が公式非対応のため、分割表示から除外しています。</li>
       </ul>
     </div>
@@ -142,7 +173,7 @@ HTML = """<!DOCTYPE html>
   ></script>
   <script>
     const map = L.map("map").setView([35.681236, 139.767125], 10);
-    L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
+    const baseTiles = L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
       maxZoom: 18,
       attribution: "© OpenStreetMap contributors",
     }).addTo(map);
@@ -161,6 +192,15 @@ HTML = """<!DOCTYPE html>
     const buttonsSection = siteButtons;
     const inputCoordsEl = document.getElementById("input-coords");
     const jumpBtn = document.getElementById("jump-btn");
+    const routeBtn = document.getElementById("route-btn");
+    const routeStatusEl = document.getElementById("route-status");
+    const idxTimeEl = document.getElementById("idx-time");
+    const idxPointEl = document.getElementById("idx-point");
+    const nowcastSparkEl = document.getElementById("nowcast-spark");
+    const nowcastStatusEl = document.getElementById("nowcast-status");
+    const skillModelEl = document.getElementById("skill-model");
+    const offlineDownloadBtn = document.getElementById("offline-download");
+    const offlineStatusEl = document.getElementById("offline-status");
 
     const openScwBtn = document.getElementById("open-scw");
     const openCoBtn = document.getElementById("open-co");
@@ -191,6 +231,50 @@ HTML = """<!DOCTYPE html>
     const WINDY_EMBED_BASE = "https://embed.windy.com/embed2.html";
     const VENTUSKY_Z = 6;
     const VENTUSKY_LAYER = "clouds-total";
+    // ローカルAPI（scw_server.py）はHTTPで配信されている場合のみ使える
+    const LOCAL_API = location.protocol === "http:" || location.protocol === "https:";
+    const ISOCHRONE_COLORS = { 1: "#22c55e", 2: "#eab308", 3: "#ef4444" };
+    const INDEX_LAYERS = { seeing: "シーイング", transparency: "透明度" };
+    // 先読み（お気に入りのホバー/フォーカス時）
+    const PREFETCH_DWELL_MS = 120;
+    const PREFETCH_TILE_MAX = 24;
+    const WARMED_TILES_MAX = 2000;
+    const GEOCODE_CACHE_MAX = 200;
+    const LINK_CACHE_MAX = 200;
+    // Nominatim の利用規約（1 秒 1 リクエスト）を先読みでも守る
+    const GEOCODE_MIN_INTERVAL_MS = 1000;
+    const NOMINATIM_ORIGIN = "https://nominatim.openstreetmap.org";
+    // このページ自身が取得する先は preconnect、別タブで開くサイトは dns-prefetch
+    const PRECONNECT_ORIGINS = [
+      { href: NOMINATIM_ORIGIN, cors: true },
+      { href: "https://a.tile.openstreetmap.org", cors: false },
+      { href: "https://b.tile.openstreetmap.org", cors: false },
+      { href: "https://c.tile.openstreetmap.org", cors: false },
+    ];
+    const SITE_ORIGINS = [
+      "https://supercweather.com",
+      "https://clearoutside.com",
+      "https://www.windy.com",
+      "https://embed.windy.com",
+      "https://www.lightpollutionmap.info",
+      "https://stellarium-web.org",
+      "https://www.meteoblue.com",
+      "https://www.ventusky.com",
+    ];
+    const NOWCAST_HOURS = 12;
+    // オフライン対応（Service Worker と同じキャッシュ名を使う）
+    const SW_SUPPORTED = LOCAL_API && "serviceWorker" in navigator;
+    const TILE_CACHE_NAME = "scw-tiles-v1";
+    const GEOCODE_CACHE_NAME = "scw-geocode-v1";
+    const OFFLINE_RADIUS_KM = 10;
+    const OFFLINE_EXTRA_ZOOMS = 2;
+    const OFFLINE_TILE_MAX = 400;
+    // OSM のタイル利用規約: z17 以上の一括取得は禁止、並列取得は 2 本まで
+    const OFFLINE_MAX_ZOOM = 16;
+    const OFFLINE_CONCURRENCY = 2;
+    // 続けての一括保存は断る（前回の時刻を localStorage に残す）
+    const OFFLINE_COOLDOWN_MS = 30 * 60 * 1000;
+    const OFFLINE_LOG_KEY = "scw_picker_offline_download_v1";
 
     const siteButtonIds = [
       "open-scw",
@@ -245,16 +329,60 @@ HTML = """<!DOCTYPE html>
     const ventuskyUrl = (lat, lng) =>
       `https://www.ventusky.com/?p=${lat.toFixed(2)};${lng.toFixed(2)};${VENTUSKY_Z}&l=${VENTUSKY_LAYER}`;
 
+    const prefetchStats = {
+      links: { hits: 0, misses: 0 },
+      geocode: { hits: 0, misses: 0 },
+      tiles: { hits: 0, misses: 0 },
+      cancelled: 0,
+    };
+
+    function trimCache(cache, max) {
+      while (cache.size > max) cache.delete(cache.keys().next().value);
+    }
+
+    // 逆ジオコーディングは座標を丸めたキーで Promise ごとキャッシュし、先読みと本番で共有する
+    const geocodeCache = new Map();
+    let lastGeocodeAt = 0;
+    const geocodeKey = (lat, lng) => `${lat.toFixed(4)},${lng.toFixed(4)}`;
+
+    function requestPlacename(lat, lng, speculative) {
+      const key = geocodeKey(lat, lng);
+      const cached = geocodeCache.get(key);
+      if (cached) {
+        if (!speculative) cached.speculative = false;
+        return { entry: cached, hit: true };
+      }
+      const controller = new AbortController();
+      const entry = { controller, speculative, settled: false };
+      lastGeocodeAt = Date.now();
+      entry.promise = fetch(
+        `${NOMINATIM_ORIGIN}/reverse?format=jsonv2&lat=${lat}&lon=${lng}&accept-language=ja`,
+        { headers: { "User-Agent": "scw-picker/1.0" }, signal: controller.signal }
+      )
+        .then((res) => {
+          if (!res.ok) throw new Error(`status ${res.status}`);
+          return res.json();
+        })
+        .then((data) => data.display_name || null)
+        .finally(() => {
+          entry.settled = true;
+        });
+      // 失敗は覚えない（次回また取りに行く）
+      entry.promise.catch(() => {
+        if (geocodeCache.get(key) === entry) geocodeCache.delete(key);
+      });
+      geocodeCache.set(key, entry);
+      trimCache(geocodeCache, GEOCODE_CACHE_MAX);
+      return { entry, hit: false };
+    }
+
     async function updatePlacename(lat, lng) {
       placeEl.textContent = "取得中...";
+      const { entry, hit } = requestPlacename(lat, lng, false);
+      prefetchStats.geocode[hit ? "hits" : "misses"]++;
       try {
-        const res = await fetch(
-          `https://nominatim.openstreetmap.org/reverse?format=jsonv2&lat=${lat}&lon=${lng}&accept-language=ja`,
-          { headers: { "User-Agent": "scw-picker/1.0" } }
-        );
-        if (!res.ok) throw new Error(`status ${res.status}`);
-        const data = await res.json();
-        placeEl.textContent = data.display_name || "名前を取得できませんでした";
+        const name = await entry.promise;
+        placeEl.textContent = name || "名前を取得できませんでした";
       } catch (err) {
         placeEl.textContent = "名前を取得できませんでした";
         console.error(err);
@@ -273,11 +401,14 @@ HTML = """<!DOCTYPE html>
       openStellaBtn.disabled = false;
       openVentuskyBtn.disabled = false;
       openMeteoblueBtn.disabled = false;
+      routeBtn.disabled = !LOCAL_API;
+      offlineDownloadBtn.disabled = !SW_SUPPORTED;
       favSaveBtn.disabled = false;
     }
 
     function setLocation(lat, lng, opts = { pan: true, scroll: true, zoom: null }) {
       currentLatLng = { lat, lng };
+      clearRoutes();
       if (!marker) {
         marker = L.marker([lat, lng]).addTo(map);
       } else {
@@ -294,7 +425,7 @@ HTML = """<!DOCTYPE html>
       }
     }
 
-    function updateLinks(lat, lng) {
+    function buildLinks(lat, lng) {
       const params = new URLSearchParams({
         lat: lat.toFixed(6),
         lng: lng.toFixed(6),
@@ -302,35 +433,179 @@ HTML = """<!DOCTYPE html>
         element: DEFAULT_ELEMENT,
         zl: DEFAULT_ZL,
       });
-      const scwUrl = `https://supercweather.com/?${params.toString()}`;
-      const coUrl = `https://clearoutside.com/forecast/${lat.toFixed(4)}/${lng.toFixed(4)}`;
-      const wUrl = windyEmbedUrl(lat, lng, "ecmwf");
-      const wGfsUrl = windyEmbedUrl(lat, lng, "gfs");
-      // MSMは embed2 非対応のため本家URLを使用（ピッカーなし）
-      const wJmaUrl = windyJmaUrl(lat, lng);
-      const wIconUrl = windyEmbedUrl(lat, lng, "icon");
-      const lpUrl = lpmUrl(lat, lng);
-      const stUrl = stellariumUrl(lat, lng);
-      const mbUrl = meteoblueUrl(lat, lng);
-      const vsUrl = ventuskyUrl(lat, lng);
+      return {
+        scw: `https://supercweather.com/?${params.toString()}`,
+        co: `https://clearoutside.com/forecast/${lat.toFixed(4)}/${lng.toFixed(4)}`,
+        windy: windyEmbedUrl(lat, lng, "ecmwf"),
+        windyGfs: windyEmbedUrl(lat, lng, "gfs"),
+        // MSMは embed2 非対応のため本家URLを使用（ピッカーなし）
+        windyJma: windyJmaUrl(lat, lng),
+        windyIcon: windyEmbedUrl(lat, lng, "icon"),
+        lpm: lpmUrl(lat, lng),
+        stella: stellariumUrl(lat, lng),
+        meteoblue: meteoblueUrl(lat, lng),
+        ventusky: ventuskyUrl(lat, lng),
+      };
+    }
+
+    // Windy/LPM のURLは地図ズームに依存するのでキーに含める
+    const linkCache = new Map();
+    const linkKey = (lat, lng) => `${lat.toFixed(6)},${lng.toFixed(6)},${map.getZoom()}`;
+
+    function getLinks(lat, lng, speculative = false) {
+      const key = linkKey(lat, lng);
+      let links = linkCache.get(key);
+      if (!speculative) prefetchStats.links[links ? "hits" : "misses"]++;
+      if (!links) {
+        links = buildLinks(lat, lng);
+        linkCache.set(key, links);
+        trimCache(linkCache, LINK_CACHE_MAX);
+      }
+      return links;
+    }
+
+    function updateLinks(lat, lng) {
+      const links = getLinks(lat, lng);
 
       coordsEl.textContent = `${lat.toFixed(6)}, ${lng.toFixed(6)}`;
       updatePlacename(lat, lng);
+      updateIndexPoint(lat, lng);
+      updateNowcast(lat, lng);
+      updateDefaultModel();
       enableButtons();
 
-      openScwBtn.onclick = () => window.open(scwUrl, "_blank");
-      openCoBtn.onclick = () => window.open(coUrl, "_blank");
-      openWindyBtn.onclick = () => window.open(wUrl, "_blank");
-      openWindyGfsBtn.onclick = () => window.open(wGfsUrl, "_blank");
-      openWindyJmaBtn.onclick = () => window.open(wJmaUrl, "_blank");
-      openWindyIconBtn.onclick = () => window.open(wIconUrl, "_blank");
-      openLpmBtn.onclick = () => window.open(lpUrl, "_blank");
-      openStellaBtn.onclick = () => window.open(stUrl, "_blank");
-      openMeteoblueBtn.onclick = () => window.open(mbUrl, "_blank");
-      openVentuskyBtn.onclick = () => window.open(vsUrl, "_blank");
+      openScwBtn.onclick = () => window.open(links.scw, "_blank");
+      openCoBtn.onclick = () => window.open(links.co, "_blank");
+      openWindyBtn.onclick = () => window.open(links.windy, "_blank");
+      openWindyGfsBtn.onclick = () => window.open(links.windyGfs, "_blank");
+      openWindyJmaBtn.onclick = () => window.open(links.windyJma, "_blank");
+      openWindyIconBtn.onclick = () => window.open(links.windyIcon, "_blank");
+      openLpmBtn.onclick = () => window.open(links.lpm, "_blank");
+      openStellaBtn.onclick = () => window.open(links.stella, "_blank");
+      openMeteoblueBtn.onclick = () => window.open(links.meteoblue, "_blank");
+      openVentuskyBtn.onclick = () => window.open(links.ventusky, "_blank");
       openWindyQuadBtn.onclick = () => openWindyQuadWindow(lat, lng);
     }
 
+    // 地図タイルの先読み: 表示中のズームで、移動先を中心とした画面分のタイルを画像として取得しておく
+    const warmedTiles = new Set();
+    let speculativeTiles = [];
+
+    function warmTiles(lat, lng, key) {
+      const z = map.getZoom();
+      const size = map.getSize();
+      const center = map.project([lat, lng], z);
+      const n = 2 ** z;
+      const x0 = Math.floor((center.x - size.x / 2) / 256);
+      const x1 = Math.floor((center.x + size.x / 2) / 256);
+      const y0 = Math.max(0, Math.floor((center.y - size.y / 2) / 256));
+      const y1 = Math.min(n - 1, Math.floor((center.y + size.y / 2) / 256));
+      let count = 0;
+      for (let y = y0; y <= y1; y++) {
+        for (let x = x0; x <= x1; x++) {
+          if (count >= PREFETCH_TILE_MAX) return;
+          const url = baseTiles.getTileUrl({ x: ((x % n) + n) % n, y, z });
+          if (warmedTiles.has(url)) continue;
+          warmedTiles.add(url);
+          trimCache(warmedTiles, WARMED_TILES_MAX);
+          const img = new Image();
+          const item = { img, url, key };
+          img.onload = img.onerror = () => {
+            speculativeTiles = speculativeTiles.filter((t) => t !== item);
+          };
+          img.src = url;
+          speculativeTiles.push(item);
+          count++;
+        }
+      }
+    }
+
+    baseTiles.on("tileload", (e) => {
+      prefetchStats.tiles[warmedTiles.has(e.tile.src) ? "hits" : "misses"]++;
+    });
+
+    // 先読みスケジューラ: アイドル時間に低優先度で実行し、本物の入力が来たら取り消す
+    const requestIdle = window.requestIdleCallback || ((cb) => setTimeout(() => cb({ timeRemaining: () => 8 }), 50));
+    const cancelIdle = window.cancelIdleCallback || clearTimeout;
+    let prefetchQueue = [];
+    let idleHandle = null;
+    let hoverTimer = null;
+
+    function runPrefetch(deadline) {
+      idleHandle = null;
+      while (prefetchQueue.length && deadline.timeRemaining() > 2) {
+        prefetchQueue.shift()();
+      }
+      if (prefetchQueue.length) idleHandle = requestIdle(runPrefetch);
+    }
+
+    function cancelSpeculative(keepKey = null) {
+      clearTimeout(hoverTimer);
+      if (idleHandle !== null) {
+        cancelIdle(idleHandle);
+        idleHandle = null;
+      }
+      prefetchStats.cancelled += prefetchQueue.length;
+      prefetchQueue = [];
+      speculativeTiles = speculativeTiles.filter((t) => {
+        if (t.key === keepKey) return true;
+        t.img.onload = t.img.onerror = null;
+        t.img.src = "";
+        warmedTiles.delete(t.url);
+        prefetchStats.cancelled++;
+        return false;
+      });
+      geocodeCache.forEach((entry, key) => {
+        if (entry.speculative && !entry.settled && key !== keepKey) {
+          entry.controller.abort();
+          geocodeCache.delete(key);
+          prefetchStats.cancelled++;
+        }
+      });
+    }
+
+    function prefetchLocation(lat, lng) {
+      clearTimeout(hoverTimer);
+      hoverTimer = setTimeout(() => {
+        const key = geocodeKey(lat, lng);
+        cancelSpeculative(key);
+        prefetchQueue.push(
+          () => getLinks(lat, lng, true),
+          () => warmTiles(lat, lng, key),
+          () => {
+            if (Date.now() - lastGeocodeAt >= GEOCODE_MIN_INTERVAL_MS) requestPlacename(lat, lng, true);
+          }
+        );
+        if (idleHandle === null) idleHandle = requestIdle(runPrefetch);
+      }, PREFETCH_DWELL_MS);
+    }
+
+    // ポインタ押下・キー入力は本物の入力とみなして先読みを止める（操作中のお気に入りの分は残す）
+    const activeFavKey = (el) => el?.closest?.(".fav-item")?.dataset.geokey ?? null;
+    document.addEventListener("pointerdown", (e) => cancelSpeculative(activeFavKey(e.target)), true);
+    document.addEventListener("keydown", () => cancelSpeculative(activeFavKey(document.activeElement)), true);
+
+    (function addResourceHints() {
+      PRECONNECT_ORIGINS.forEach(({ href, cors }) => {
+        const link = document.createElement("link");
+        link.rel = "preconnect";
+        link.href = href;
+        if (cors) link.crossOrigin = "anonymous";
+        document.head.appendChild(link);
+      });
+      SITE_ORIGINS.forEach((href) => {
+        const link = document.createElement("link");
+        link.rel = "dns-prefetch";
+        link.href = href;
+        document.head.appendChild(link);
+      });
+    })();
+
+    window.scwPrefetch = {
+      stats: prefetchStats,
+      cancel: () => cancelSpeculative(null),
+    };
+
     function loadFavorites() {
       try {
         const data = localStorage.getItem(FAV_KEY);
@@ -410,6 +685,134 @@ HTML = """<!DOCTYPE html>
 
     let dragSrcIndex = null;
 
+    // ドライブ時間（scw_server.py の /api/route）
+    const isochroneLayer = L.layerGroup().addTo(map);
+    let driveTimes = new Map();
+    const favKey = (fav) => `${Number(fav.lat).toFixed(5)},${Number(fav.lng).toFixed(5)}`;
+
+    function formatDriveTime(seconds) {
+      if (seconds == null) return "到達不可";
+      const min = Math.round(seconds / 60);
+      return min >= 60 ? `車 ${Math.floor(min / 60)}時間${min % 60}分` : `車 ${min}分`;
+    }
+
+    function clearRoutes() {
+      isochroneLayer.clearLayers();
+      driveTimes = new Map();
+    }
+
+    async function fetchRoutes() {
+      if (!LOCAL_API || !currentLatLng) return;
+      // setLocation は毎回新しいオブジェクトを入れるので、参照の比較で地点の移動を検出できる
+      const origin = currentLatLng;
+      const { lat, lng } = origin;
+      routeStatusEl.textContent = "計算中...";
+      routeBtn.disabled = true;
+      try {
+        const res = await fetch("/api/route", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ lat, lng, favorites: loadFavorites() }),
+        });
+        const data = await res.json();
+        if (currentLatLng !== origin) {
+          // 計算中にマーカーが動いた。古い出発地の等時間線は描かない
+          routeStatusEl.textContent = "未計算";
+          return;
+        }
+        if (!res.ok) throw new Error(data.error || `status ${res.status}`);
+        clearRoutes();
+        // 外側（3h）から描画して内側が上に重なるようにする
+        Object.keys(data.isochrones)
+          .sort((a, b) => Number(b) - Number(a))
+          .forEach((h) => {
+            const color = ISOCHRONE_COLORS[h] || "#60a5fa";
+            L.polygon(data.isochrones[h], { color, weight: 1, fillOpacity: 0.12 })
+              .bindTooltip(`${h}時間圏`)
+              .addTo(isochroneLayer);
+          });
+        data.favorites.forEach((f) => driveTimes.set(favKey(f), f.seconds));
+        routeStatusEl.textContent = data.cache_hit ? "計算済み（キャッシュ）" : "計算しました";
+        renderFavorites();
+      } catch (err) {
+        if (currentLatLng !== origin) return;
+        routeStatusEl.textContent = `計算できませんでした: ${err.message}`;
+        console.error(err);
+      } finally {
+        routeBtn.disabled = false;
+      }
+    }
+
+    routeBtn.onclick = fetchRoutes;
+    if (LOCAL_API) routeStatusEl.textContent = "未計算";
+
+    // シーイング・透明度（scw_server.py の /api/indices と /tiles）
+    const indexLayers = {};
+    let indexTimes = [];
+    let indexPoint = null;
+    const indexTileUrl = (name, t) => `/tiles/${name}/${t}/{z}/{x}/{y}.png`;
+    const formatIndexTime = (t) => `${String(t).slice(0, 16).replace("T", " ")} UTC`;
+
+    function renderIndexPoint() {
+      if (!indexPoint) return;
+      const t = Number(idxTimeEl.value) || 0;
+      idxPointEl.textContent = `シーイング ${indexPoint.seeing[t].toFixed(2)}″ / 透明度 ${indexPoint.transparency[t].toFixed(2)}（格子点 ${indexPoint.lat.toFixed(3)}, ${indexPoint.lng.toFixed(3)}）`;
+    }
+
+    async function updateIndexPoint(lat, lng) {
+      if (indexTimes.length === 0) return;
+      const origin = currentLatLng;
+      idxPointEl.textContent = "取得中...";
+      try {
+        const res = await fetch(`/api/indices/point?lat=${lat}&lng=${lng}`);
+        const data = await res.json();
+        if (currentLatLng !== origin) return;
+        if (!res.ok) throw new Error(data.error || `status ${res.status}`);
+        indexPoint = data;
+        renderIndexPoint();
+      } catch (err) {
+        if (currentLatLng !== origin) return;
+        indexPoint = null;
+        idxPointEl.textContent = `取得できませんでした: ${err.message}`;
+      }
+    }
+
+    async function initIndices() {
+      if (!LOCAL_API) return;
+      try {
+        const res = await fetch("/api/indices/meta");
+        if (!res.ok) {
+          idxPointEl.textContent = "未設定（scw_server.py --indices）";
+          return;
+        }
+        indexTimes = (await res.json()).times;
+      } catch (err) {
+        console.error(err);
+        return;
+      }
+      idxTimeEl.innerHTML = "";
+      indexTimes.forEach((t, i) => {
+        const opt = document.createElement("option");
+        opt.value = String(i);
+        opt.textContent = formatIndexTime(t);
+        idxTimeEl.appendChild(opt);
+      });
+      idxTimeEl.disabled = false;
+      const overlays = {};
+      Object.entries(INDEX_LAYERS).forEach(([name, label]) => {
+        indexLayers[name] = L.tileLayer(indexTileUrl(name, 0), { maxZoom: 18, opacity: 0.7 });
+        overlays[label] = indexLayers[name];
+      });
+      L.control.layers(null, overlays).addTo(map);
+      idxTimeEl.onchange = () => {
+        const t = Number(idxTimeEl.value) || 0;
+        Object.entries(indexLayers).forEach(([name, layer]) => layer.setUrl(indexTileUrl(name, t)));
+        renderIndexPoint();
+      };
+      idxPointEl.textContent = "地点未選択";
+      if (currentLatLng) updateIndexPoint(currentLatLng.lat, currentLatLng.lng);
+    }
+
     function renderFavorites() {
       const favs = loadFavorites();
       favListEl.innerHTML = "";
@@ -421,6 +824,10 @@ HTML = """<!DOCTYPE html>
           wrap.className = "fav-item";
           wrap.draggable = true;
           wrap.dataset.index = idx;
+          wrap.dataset.geokey = geocodeKey(fav.lat, fav.lng);
+          wrap.addEventListener("pointerenter", () => prefetchLocation(fav.lat, fav.lng));
+          wrap.addEventListener("pointerleave", () => clearTimeout(hoverTimer));
+          wrap.addEventListener("focusin", () => prefetchLocation(fav.lat, fav.lng));
           const btn = document.createElement("button");
           btn.textContent = fav.name;
           btn.onclick = () => {
@@ -432,6 +839,7 @@ HTML = """<!DOCTYPE html>
               marker.setLatLng([lat, lng]);
             }
             currentLatLng = { lat, lng };
+            clearRoutes();
             updateLinks(lat, lng);
             renderFavorites();
           };
@@ -448,6 +856,13 @@ HTML = """<!DOCTYPE html>
           nameSpan.textContent = `(${fav.lat.toFixed(4)}, ${fav.lng.toFixed(4)})`;
           wrap.appendChild(btn);
           wrap.appendChild(nameSpan);
+          const drive = driveTimes.get(favKey(fav));
+          if (drive !== undefined) {
+            const driveSpan = document.createElement("span");
+            driveSpan.className = "fav-drive";
+            driveSpan.textContent = formatDriveTime(drive);
+            wrap.appendChild(driveSpan);
+          }
           wrap.appendChild(del);
 
           wrap.addEventListener("dragstart", (e) => {
@@ -676,8 +1091,192 @@ HTML = """<!DOCTYPE html>
       applyTheme(current === "dark" ? "light" : "dark");
     };
 
+    // 雲量の推移（scw_server.py の /api/nowcast）
+    function sparklineSvg(history, forecast, width = 220, height = 36) {
+      const all = [...history, ...forecast];
+      if (all.length < 2) return "";
+      const step = width / (all.length - 1);
+      const toPoints = (values, offset) =>
+        values
+          .map((v, i) => (v == null ? null : `${((offset + i) * step).toFixed(1)},${(height - 2 - (v / 100) * (height - 4)).toFixed(1)}`))
+          .filter(Boolean)
+          .join(" ");
+      // 予測の線は実況の最後の点からつなげる
+      const joinOffset = Math.max(history.length - 1, 0);
+      const forecastLine = history.length ? [history[history.length - 1], ...forecast] : forecast;
+      return `<svg class="sparkline" width="${width}" height="${height}" viewBox="0 0 ${width} ${height}">
+        <polyline fill="none" stroke="var(--accent)" stroke-width="1.5" points="${toPoints(history, 0)}" />
+        <polyline fill="none" stroke="var(--accent)" stroke-width="1.5" stroke-dasharray="3 2" points="${toPoints(forecastLine, joinOffset)}" />
+      </svg>`;
+    }
+
+    async function updateNowcast(lat, lng) {
+      if (!LOCAL_API) return;
+      const origin = currentLatLng;
+      // 前の地点のスパークラインを残さない
+      if (marker) marker.unbindTooltip();
+      nowcastStatusEl.textContent = "取得中...";
+      nowcastSparkEl.innerHTML = "";
+      try {
+        const res = await fetch(`/api/nowcast?lat=${lat}&lng=${lng}&hours=${NOWCAST_HOURS}`);
+        const data = await res.json();
+        if (currentLatLng !== origin) return;
+        if (res.status === 503) {
+          // busy: リングバッファの更新と重なって読めなかった（設定はされている）
+          nowcastStatusEl.textContent = data.busy ? "雲量フレームの更新中です。少し待ってから選び直してください" : "未設定（scw_server.py --nowcast）";
+          return;
+        }
+        if (!res.ok) throw new Error(data.error || `status ${res.status}`);
+        const forecast = data.nowcast ? data.nowcast.values : [];
+        const svg = sparklineSvg(data.values, forecast);
+        nowcastSparkEl.innerHTML = svg;
+        const last = [...data.values].reverse().find((v) => v != null);
+        const next = forecast.find((v) => v != null);
+        nowcastStatusEl.textContent = `直近 ${last ?? "-"}%` + (next != null ? ` → 予測 ${next}%（${data.nowcast.times[0]}）` : "");
+        if (marker && svg) marker.bindTooltip(svg, { direction: "top" });
+      } catch (err) {
+        if (currentLatLng !== origin) return;
+        nowcastStatusEl.textContent = `取得できませんでした: ${err.message}`;
+      }
+    }
+
+    // 実績からの推奨モデル（scw_server.py の /api/archive/default-model）。モデル名は scw_archive.py の表記
+    const MODEL_BUTTONS = {
+      msm78: openScwBtn,
+      ecmwf: openWindyBtn,
+      gfs: openWindyGfsBtn,
+      icon: openWindyIconBtn,
+      jma_msm: openWindyJmaBtn,
+    };
+
+    async function updateDefaultModel() {
+      if (!LOCAL_API || !currentLatLng) return;
+      const origin = currentLatLng;
+      Object.values(MODEL_BUTTONS).forEach((btn) => btn.classList.remove("recommended"));
+      try {
+        const res = await fetch(`/api/archive/default-model?lat=${origin.lat}&lng=${origin.lng}`);
+        const data = await res.json();
+        if (currentLatLng !== origin) return;
+        if (res.status === 503) {
+          skillModelEl.textContent = "未設定（scw_server.py --archive --observed）";
+          return;
+        }
+        if (!res.ok) throw new Error(data.error || `status ${res.status}`);
+        if (!data.model) {
+          skillModelEl.textContent = "採点できる予報がまだありません";
+          return;
+        }
+        skillModelEl.textContent = `${data.model}（${data.scope === "site" ? "この地点" : "全地点"}の実績）`;
+        if (MODEL_BUTTONS[data.model]) MODEL_BUTTONS[data.model].classList.add("recommended");
+      } catch (err) {
+        if (currentLatLng === origin) skillModelEl.textContent = `取得できませんでした: ${err.message}`;
+      }
+    }
+
+    // オフライン対応（Service Worker の登録・保存容量の表示・周辺タイルの一括保存）
+    const osmTileUrl = (x, y, z) => `https://${"abc"[Math.abs(x + y) % 3]}.tile.openstreetmap.org/${z}/${x}/${y}.png`;
+    // Service Worker の tileKey と同じ（サブドメインなし）
+    const osmTileKey = (url) => `https://tile.openstreetmap.org${new URL(url).pathname}`;
+
+    async function cacheEntryCount(name) {
+      if (!(await caches.has(name))) return 0;
+      return (await (await caches.open(name)).keys()).length;
+    }
+
+    async function updateStorageStatus(prefix = "") {
+      if (!SW_SUPPORTED) return;
+      try {
+        const [tiles, geocodes] = await Promise.all([cacheEntryCount(TILE_CACHE_NAME), cacheEntryCount(GEOCODE_CACHE_NAME)]);
+        let usage = "";
+        if (navigator.storage && navigator.storage.estimate) {
+          const est = await navigator.storage.estimate();
+          const mb = (v) => (v / 1024 / 1024).toFixed(1);
+          usage = ` / 使用量 ${mb(est.usage || 0)}MB（上限 ${mb(est.quota || 0)}MB）`;
+        }
+        offlineStatusEl.textContent = `${prefix}タイル ${tiles}件・地名 ${geocodes}件${usage}`;
+      } catch (err) {
+        console.error(err);
+      }
+    }
+
+    function regionTileUrls(lat, lng) {
+      const urls = [];
+      const dLat = OFFLINE_RADIUS_KM / 111.32;
+      const dLng = dLat / Math.cos((lat * Math.PI) / 180);
+      const z0 = map.getZoom();
+      for (let z = Math.min(z0, OFFLINE_MAX_ZOOM); z <= Math.min(z0 + OFFLINE_EXTRA_ZOOMS, OFFLINE_MAX_ZOOM); z++) {
+        const nw = map.project([lat + dLat, lng - dLng], z);
+        const se = map.project([lat - dLat, lng + dLng], z);
+        const n = 2 ** z;
+        for (let y = Math.max(0, Math.floor(nw.y / 256)); y <= Math.min(n - 1, Math.floor(se.y / 256)); y++) {
+          for (let x = Math.floor(nw.x / 256); x <= Math.floor(se.x / 256); x++) {
+            if (urls.length >= OFFLINE_TILE_MAX) return urls;
+            urls.push(osmTileUrl(((x % n) + n) % n, y, z));
+          }
+        }
+      }
+      return urls;
+    }
+
+    function lastDownloadAt() {
+      const t = Number(localStorage.getItem(OFFLINE_LOG_KEY));
+      return Number.isFinite(t) ? t : 0;
+    }
+
+    async function downloadRegion() {
+      if (!SW_SUPPORTED || !currentLatLng) return;
+      const waitMs = lastDownloadAt() + OFFLINE_COOLDOWN_MS - Date.now();
+      if (waitMs > 0) {
+        offlineStatusEl.textContent = `続けての一括保存はできません（あと ${Math.ceil(waitMs / 60000)} 分）`;
+        return;
+      }
+      offlineDownloadBtn.disabled = true;
+      if (navigator.storage && navigator.storage.persist) navigator.storage.persist();
+      // 保存済みのタイルは取り直さない
+      const cache = await caches.open(TILE_CACHE_NAME);
+      const candidates = regionTileUrls(currentLatLng.lat, currentLatLng.lng);
+      const cached = await Promise.all(candidates.map((url) => cache.match(osmTileKey(url))));
+      const urls = candidates.filter((_, i) => !cached[i]);
+      if (!urls.length) {
+        offlineDownloadBtn.disabled = false;
+        updateStorageStatus("この周辺は保存済みです: ");
+        return;
+      }
+      localStorage.setItem(OFFLINE_LOG_KEY, String(Date.now()));
+      let done = 0;
+      let failed = 0;
+      // 取得は Service Worker が横取りしてタイルキャッシュに保存する
+      const worker = async () => {
+        while (urls.length) {
+          const url = urls.shift();
+          try {
+            const res = await fetch(url, { mode: "cors", credentials: "omit" });
+            if (!res.ok) failed++;
+          } catch {
+            failed++;
+          }
+          done++;
+          offlineStatusEl.textContent = `保存中... ${done}枚`;
+        }
+      };
+      await Promise.all(Array.from({ length: OFFLINE_CONCURRENCY }, worker));
+      offlineDownloadBtn.disabled = false;
+      updateStorageStatus(failed ? `保存完了（失敗 ${failed}枚）: ` : "保存完了: ");
+    }
+
+    offlineDownloadBtn.onclick = downloadRegion;
+    if (SW_SUPPORTED) {
+      navigator.serviceWorker
+        .register("/sw.js")
+        .then(() => updateStorageStatus())
+        .catch((err) => {
+          offlineStatusEl.textContent = `オフライン対応を有効にできませんでした: ${err.message}`;
+        });
+    }
+
     setupSiteDrag();
     renderFavorites();
+    initIndices();
 
     // 星の流れ（ダークモードのみ表示）: 日周運動をイメージ
     const starCanvas = document.getElementById("starCanvas");
@@ -747,6 +1346,148 @@ HTML = """<!DOCTYPE html>
 </html>
 """
 
+SERVICE_WORKER_JS = """// scw_picker の Service Worker（scw_server.py が /sw.js として配信する）
+// アプリ本体は事前キャッシュ、地図タイルはキャッシュ優先（LRU）、地名は stale-while-revalidate
+const SHELL_VERSION = "__SHELL_VERSION__";
+const SHELL_CACHE = `scw-shell-${SHELL_VERSION}`;
+const TILE_CACHE = "scw-tiles-v1";
+const GEOCODE_CACHE = "scw-geocode-v1";
+const TILE_MAX_ENTRIES = 4000;
+const GEOCODE_MAX_ENTRIES = 500;
+// 上限を超えたら、この割合だけ余分に削って keys() の呼び出しを間引く
+const TRIM_SLACK = 0.05;
+const LEAFLET_BASE = "https://unpkg.com/leaflet@1.9.4/dist/";
+const SHELL_URLS = [
+  "/",
+  `${LEAFLET_BASE}leaflet.css`,
+  `${LEAFLET_BASE}leaflet.js`,
+  `${LEAFLET_BASE}images/marker-icon.png`,
+  `${LEAFLET_BASE}images/marker-icon-2x.png`,
+  `${LEAFLET_BASE}images/marker-shadow.png`,
+  `${LEAFLET_BASE}images/layers.png`,
+  `${LEAFLET_BASE}images/layers-2x.png`,
+];
+const SHELL_HREFS = new Set(SHELL_URLS.map((u) => new URL(u, self.location).href));
+const TILE_HOST_SUFFIX = ".tile.openstreetmap.org";
+const NOMINATIM_HOST = "nominatim.openstreetmap.org";
+
+self.addEventListener("install", (event) => {
+  event.waitUntil(
+    caches
+      .open(SHELL_CACHE)
+      .then((cache) => cache.addAll(SHELL_URLS))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener("activate", (event) => {
+  const keep = new Set([SHELL_CACHE, TILE_CACHE, GEOCODE_CACHE]);
+  event.waitUntil(
+    caches
+      .keys()
+      .then((names) => Promise.all(names.filter((n) => n.startsWith("scw-") && !keep.has(n)).map((n) => caches.delete(n))))
+      .then(() => Promise.all([trim(TILE_CACHE, TILE_MAX_ENTRIES), trim(GEOCODE_CACHE, GEOCODE_MAX_ENTRIES)]))
+      .then(() => self.clients.claim())
+  );
+});
+
+// Cache API の keys() は追加順。put し直すと末尾に移るので、先頭ほど長く使われていない
+// 削除後の件数を返す
+async function trim(name, max) {
+  const cache = await caches.open(name);
+  const keys = await cache.keys();
+  const excess = Math.max(0, keys.length - max);
+  await Promise.all(keys.slice(0, excess).map((req) => cache.delete(req)));
+  return keys.length - excess;
+}
+
+// 件数の見積もり。ワーカーはアイドルで止まるとメモリが消えるので、起動後最初の put で数え直す。
+// 既存キーの上書きも 1 件と数えるため多めに出るが、超えたときは trim が実数で数え直す
+const entryCounts = {};
+async function putBounded(cache, name, max, key, response) {
+  await cache.put(key, response);
+  if (entryCounts[name] === undefined) entryCounts[name] = (await cache.keys()).length;
+  else entryCounts[name]++;
+  if (entryCounts[name] > max) entryCounts[name] = await trim(name, Math.floor(max * (1 - TRIM_SLACK)));
+}
+
+const offlineResponse = () =>
+  new Response(JSON.stringify({ error: "offline" }), { status: 504, headers: { "Content-Type": "application/json" } });
+
+// サブドメイン(a/b/c)の違いを吸収して 1 枚を 1 件として保存する
+const tileKey = (url) => `https://tile.openstreetmap.org${url.pathname}`;
+
+async function handleTile(event, url) {
+  const cache = await caches.open(TILE_CACHE);
+  const key = tileKey(url);
+  const cached = await cache.match(key);
+  if (cached) {
+    event.waitUntil(cache.put(key, cached.clone()));
+    return cached;
+  }
+  try {
+    // CORS で取ると不透明レスポンスにならず、保存容量の見積もりが膨らまない
+    const res = await fetch(new Request(url.href, { mode: "cors", credentials: "omit" }));
+    if (res.ok) event.waitUntil(putBounded(cache, TILE_CACHE, TILE_MAX_ENTRIES, key, res.clone()));
+    return res;
+  } catch {
+    return new Response("", { status: 504 });
+  }
+}
+
+// ページ側と同じく小数 4 桁（約 10m）に丸めた座標をキーにする
+function geocodeKey(url) {
+  const lat = Number(url.searchParams.get("lat")).toFixed(4);
+  const lon = Number(url.searchParams.get("lon")).toFixed(4);
+  const lang = url.searchParams.get("accept-language") || "";
+  return `https://${NOMINATIM_HOST}/reverse?format=jsonv2&lat=${lat}&lon=${lon}&accept-language=${lang}`;
+}
+
+async function handleGeocode(event, url) {
+  const cache = await caches.open(GEOCODE_CACHE);
+  const key = geocodeKey(url);
+  const cached = await cache.match(key);
+  const network = fetch(event.request).then(async (res) => {
+    if (res.ok) await putBounded(cache, GEOCODE_CACHE, GEOCODE_MAX_ENTRIES, key, res.clone());
+    return res;
+  });
+  if (cached) {
+    event.waitUntil(network.catch(() => {}));
+    return cached;
+  }
+  return network.catch(offlineResponse);
+}
+
+async function handleShell(event, url) {
+  const cache = await caches.open(SHELL_CACHE);
+  const key = url.origin === self.location.origin ? "/" : url.href;
+  const cached = await cache.match(key);
+  if (cached && key !== "/") return cached;
+  // ページ本体は古い版を即座に返しつつ裏で更新する（Leaflet はバージョン固定なので更新しない）
+  const network = fetch(event.request).then(async (res) => {
+    if (res.ok) await cache.put(key, res.clone());
+    return res;
+  });
+  if (cached) {
+    event.waitUntil(network.catch(() => {}));
+    return cached;
+  }
+  return network;
+}
+
+self.addEventListener("fetch", (event) => {
+  if (event.request.method !== "GET") return;
+  const url = new URL(event.request.url);
+  if (url.hostname.endsWith(TILE_HOST_SUFFIX)) {
+    event.respondWith(handleTile(event, url));
+  } else if (url.hostname === NOMINATIM_HOST && url.pathname === "/reverse") {
+    event.respondWith(handleGeocode(event, url));
+  } else if (SHELL_HREFS.has(url.href) || (url.origin === self.location.origin && ["/", "/index.html"].includes(url.pathname))) {
+    event.respondWith(handleShell(event, url));
+  }
+});
+"""
+
 html_path = Path(__file__).resolve().with_suffix(".html")
 
 
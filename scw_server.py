@@ -0,0 +1,286 @@
+"""
+scw_picker のページとローカル API を配信する簡易 HTTP サーバー（標準ライブラリのみ）。
+使い方: python scw_server.py --graph road.graph --indices indices/ --nowcast ring/ --archive archive/ --observed observed.csv [--port 8765]
+ページを http://localhost:8765/ で開くと、ドライブ時間・等時間線、シーイング・透明度、雲量の推移、実績からの推奨モデルなどのローカル機能が使える。
+予報を取得する側は POST /api/archive/snapshot にスナップショット（scw_archive.py の形式、リスト可）を Content-Type: application/json で送るとアーカイブに追記される。
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import webbrowser
+
+import scw_picker
+
+
+# ページか Service Worker が変わるとアプリ本体のキャッシュ名も変わり、古い版は activate 時に消される
+SHELL_VERSION = hashlib.sha1((scw_picker.HTML + scw_picker.SERVICE_WORKER_JS).encode("utf-8")).hexdigest()[:12]
+SERVICE_WORKER_BODY = scw_picker.SERVICE_WORKER_JS.replace("__SHELL_VERSION__", SHELL_VERSION).encode("utf-8")
+# 成績表は実測 CSV が更新されたとき以外もこの間隔で作り直す（その間に追記された予報を反映する）
+SKILL_TTL_S = 600
+
+class PickerServer(ThreadingHTTPServer):
+  daemon_threads = True
+  # 既定の 5 では同時アクセスが集中したときに接続待ちで 1 秒単位の遅延が出る
+  request_queue_size = 128
+
+  def __init__(self, address, graph_path=None, indices_dir=None, nowcast_dir=None, archive_dir=None, observed_path=None):
+    super().__init__(address, PickerHandler)
+    self.graph_path = graph_path
+    self.indices_dir = indices_dir
+    self.nowcast_dir = nowcast_dir
+    self.archive_dir = archive_dir
+    self.observed_path = observed_path
+    self._route_service = None
+    self._index_store = None
+    self._frame_ring = None
+    self._archive = None
+    self._skill = None
+    self._lock = threading.Lock()
+    # グラフの読み込みは数秒かかるので、他の API を止めないよう別のロックにする
+    self._route_lock = threading.Lock()
+    self._skill_lock = threading.Lock()
+
+  def route_service(self):
+    """グラフは重いので最初の問い合わせ時に一度だけ読み込む。"""
+    if self.graph_path is None:
+      raise LookupError("道路グラフが指定されていません（--graph）")
+    with self._route_lock:
+      if self._route_service is None:
+        import scw_route
+        self._route_service = scw_route.RouteService(self.graph_path)
+      return self._route_service
+
+  def index_store(self):
+    """scw_indices.py compute で新しい版が出たら開き直す。古い版の配列は書き換えられないので処理中の要求も安全。"""
+    if self.indices_dir is None:
+      raise LookupError("指数の出力先が指定されていません（--indices）")
+    with self._lock:
+      if self._index_store is None or self._index_store.stale():
+        import scw_indices
+        self._index_store = scw_indices.IndexStore(self.indices_dir)
+      return self._index_store
+
+  def frame_ring(self):
+    if self.nowcast_dir is None:
+      raise LookupError("雲量リングバッファが指定されていません（--nowcast）")
+    with self._lock:
+      if self._frame_ring is None:
+        import scw_nowcast
+        self._frame_ring = scw_nowcast.FrameRing(self.nowcast_dir)
+      return self._frame_ring
+
+  def archive(self):
+    if self.archive_dir is None:
+      raise LookupError("予報アーカイブが指定されていません（--archive）")
+    with self._lock:
+      if self._archive is None:
+        import scw_archive
+        self._archive = scw_archive.ForecastArchive(self.archive_dir)
+        self._archive.start_compactor()
+      return self._archive
+
+  def skill_table(self):
+    """成績表は重いので、実測 CSV が更新されたか SKILL_TTL_S 経ったときだけ作り直す。"""
+    archive = self.archive()
+    if self.observed_path is None:
+      raise LookupError("実測雲量の CSV が指定されていません（--observed）")
+    try:
+      mtime = os.stat(self.observed_path).st_mtime_ns
+    except OSError as e:
+      raise LookupError(f"実測雲量の CSV を読めません: {e}") from None
+    import scw_archive
+    with self._skill_lock:
+      if self._skill is None or self._skill[0] != mtime or time.monotonic() - self._skill[1] > SKILL_TTL_S:
+        table = scw_archive.score(archive.load(), scw_archive.load_observations(self.observed_path))
+        self._skill = (mtime, time.monotonic(), table)
+      return self._skill[2]
+
+
+class PickerHandler(BaseHTTPRequestHandler):
+  server_version = "scw-picker/1.0"
+
+  def log_message(self, fmt, *args):
+    pass
+
+  def _send(self, status, body, content_type):
+    self.send_response(status)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(body)))
+    self.send_header("Cache-Control", "no-cache")
+    self.end_headers()
+    self.wfile.write(body)
+
+  def _send_json(self, status, obj):
+    self._send(status, json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+  def _post_refusal(self):
+    """他のサイトのページから送られた POST を断る理由（問題なければ None）。
+
+    application/json 以外の POST はブラウザが事前確認なしで送れてしまうため受け付けない。
+    Origin はブラウザからの要求にだけ付くので、付いていればこのサーバー自身であることを確かめる。
+    """
+    content_type = (self.headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
+    if content_type != "application/json":
+      return 415, "Content-Type は application/json にしてください"
+    origin = self.headers.get("Origin")
+    if origin is not None and origin != f"http://{self.headers.get('Host', '')}":
+      return 403, "他のオリジンからの要求は受け付けません"
+    return None
+
+  def _read_json(self):
+    length = int(self.headers.get("Content-Length") or 0)
+    return json.loads(self.rfile.read(length) or b"{}")
+
+  def do_GET(self):
+    path, _, query = self.path.partition("?")
+    if path in ("/", "/index.html"):
+      self._send(200, scw_picker.HTML.encode("utf-8"), "text/html; charset=utf-8")
+      return
+    if path == "/sw.js":
+      self._send(200, SERVICE_WORKER_BODY, "text/javascript; charset=utf-8")
+      return
+    try:
+      tile = TILE_PATH.fullmatch(path)
+      if tile:
+        name, t, z, x, y = tile.group(1), *map(int, tile.group(2, 3, 4, 5))
+        self._send(200, self.server.index_store().tile(name, t, z, x, y), "image/png")
+        return
+      handler = GET_ROUTES.get(path)
+      if handler is None:
+        self._send_json(404, {"error": "not found"})
+        return
+      params = {k: v[-1] for k, v in parse_qs(query).items()}
+      self._send_json(200, handler(self.server, params))
+    except KeyError as e:
+      self._send_json(400, {"error": f"missing or unknown key: {e}"})
+    except TimeoutError as e:
+      # 未設定（LookupError）と区別できるよう busy を付ける。少し待てば読める
+      self._send_json(503, {"error": str(e), "busy": True})
+    except LookupError as e:
+      self._send_json(503, {"error": str(e)})
+    except (ValueError, TypeError) as e:
+      self._send_json(400, {"error": str(e)})
+
+  def do_POST(self):
+    path = self.path.split("?", 1)[0]
+    handler = POST_ROUTES.get(path)
+    if handler is None:
+      self._send_json(404, {"error": "not found"})
+      return
+    refusal = self._post_refusal()
+    if refusal is not None:
+      self._send_json(refusal[0], {"error": refusal[1]})
+      return
+    try:
+      payload = self._read_json()
+      self._send_json(200, handler(self.server, payload))
+    except KeyError as e:
+      self._send_json(400, {"error": f"missing or unknown key: {e}"})
+    except TimeoutError as e:
+      self._send_json(503, {"error": str(e), "busy": True})
+    except LookupError as e:
+      self._send_json(503, {"error": str(e)})
+    except (ValueError, TypeError) as e:
+      self._send_json(400, {"error": str(e)})
+
+
+def api_route(server, payload):
+  if "lat" not in payload or "lng" not in payload:
+    raise ValueError("lat と lng が必要です")
+  favorites = [
+    {"name": str(f.get("name", "")), "lat": float(f["lat"]), "lng": float(f["lng"])}
+    for f in payload.get("favorites", [])
+  ]
+  return server.route_service().query(float(payload["lat"]), float(payload["lng"]), favorites)
+
+
+def api_indices_meta(server, params):
+  store = server.index_store()
+  return {"times": store.times, "has_aod": store.meta.get("has_aod", False)}
+
+
+def api_indices_point(server, params):
+  result = server.index_store().point(float(params["lat"]), float(params["lng"]))
+  if result is None:
+    raise ValueError("指数の格子の範囲外です")
+  return result
+
+
+def api_nowcast(server, params):
+  hours = float(params.get("hours", 12))
+  result = server.frame_ring().summary(float(params["lat"]), float(params["lng"]), hours=hours)
+  if result is None:
+    raise ValueError("雲量フレームの範囲外です")
+  return result
+
+
+def api_archive_snapshot(server, payload):
+  snapshots = payload if isinstance(payload, list) else [payload]
+  archive = server.archive()
+  for snap in snapshots:
+    archive.append_snapshot(snap)
+  return {"appended": len(snapshots)}
+
+
+def api_default_model(server, params):
+  """実績から選んだ既定モデル。地点の成績があればそれを、なければ全地点の成績を使う。"""
+  import scw_archive
+  table = server.skill_table()
+  max_lead = float(params.get("max_lead", 48))
+  site = scw_archive.site_key(params["lat"], params["lng"]) if "lat" in params else None
+  model = scw_archive.best_model(table, site=site, max_lead_h=max_lead) if site else None
+  if model is not None:
+    return {"model": model, "scope": "site"}
+  return {"model": scw_archive.best_model(table, max_lead_h=max_lead), "scope": "all"}
+
+
+TILE_PATH = re.compile(r"/tiles/(\w+)/(\d+)/(\d+)/(\d+)/(\d+)\.png")
+GET_ROUTES = {
+  "/api/indices/meta": api_indices_meta,
+  "/api/indices/point": api_indices_point,
+  "/api/nowcast": api_nowcast,
+  "/api/archive/default-model": api_default_model,
+}
+POST_ROUTES = {
+  "/api/route": api_route,
+  "/api/archive/snapshot": api_archive_snapshot,
+}
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="scw_picker ローカルサーバー")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8765)
+  parser.add_argument("--graph", help="scw_route.py build で作った道路グラフ")
+  parser.add_argument("--indices", help="scw_indices.py compute の出力先")
+  parser.add_argument("--nowcast", help="scw_nowcast.py init で作ったリングバッファ")
+  parser.add_argument("--archive", help="予報スナップショットのアーカイブ（scw_archive.py）")
+  parser.add_argument("--observed", help="採点に使う実測雲量 CSV（lat,lng,time,cloud）")
+  parser.add_argument("--no-browser", action="store_true")
+  args = parser.parse_args(argv)
+
+  server = PickerServer(
+    (args.host, args.port), graph_path=args.graph, indices_dir=args.indices, nowcast_dir=args.nowcast,
+    archive_dir=args.archive, observed_path=args.observed,
+  )
+  url = f"http://{args.host}:{server.server_address[1]}/"
+  print(f"{url} で配信中（Ctrl+C で終了）")
+  if not args.no_browser:
+    webbrowser.open(url)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+
+if __name__ == "__main__":
+  main()